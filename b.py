@@ -1,13 +1,25 @@
 import asyncio
+import base64
+import collections
+import itertools
+import random
 import websockets
 import json
 import httpx
 import time
 import os
+import struct
 import sys
+import tempfile
+import zlib
 from pathlib import Path
 from playwright.async_api import async_playwright
 
+try:
+    import brotli  # 可选依赖，直播间广播的 protover 3 压缩格式，未安装时改用 zlib（protover 2）
+except ImportError:
+    brotli = None
+
 # --- 配置区域 ---
 # 我已根据您提供的信息为您填好所有配置
 
@@ -21,12 +33,19 @@ SECONDARY_GROUP_IDS = [None]
 
 # [已配置] OneBot V11 服务端的 WebSocket 连接地址
 ONEBOT_WEBSOCKET_URL = "ws://127.0.0.1:15700/onebot/v11/ws"
+# 等待 OneBot 回执的超时（秒）及断线重连间隔（秒）
+ONEBOT_ACK_TIMEOUT_SECONDS = 20
+ONEBOT_RECONNECT_SECONDS = 3
 
 # [已配置] 您要关注的 Bilibili UP 主的 UID
 TARGET_UID = 316381099
 
-# [已配置] 您要监控的直播间 ID
-TARGET_LIVE_ROOM_ID = 15152878
+# 【新功能】监控目标列表，每位 UP 主一项（直播间按 UID 自动对应，无需填写房间号）
+# live 为 False 时只检查动态；groups 为该目标专属的推送群，留空则推送到主群和所有副群
+# 例如: {"uid": 123456, "live": False, "groups": [111111111]}
+TARGETS = [
+    {"uid": TARGET_UID, "live": True, "groups": []},
+]
 
 # 【新功能】将您的Cookie文件名放在这个列表中，机器人将按顺序轮换使用
 # 请确保这些文件与 b.py 在同一个目录下
@@ -35,20 +54,83 @@ COOKIE_FILE_NAMES = ["bilicookie.json", "bili2cookie.json"]
 # 【新功能】Cookie 轮换周期（小时）
 COOKIE_ROTATION_HOURS = 6
 
-# 轮询检查间隔（秒）
+# 轮询检查间隔（秒），直播和动态各自独立轮询
 CHECK_INTERVAL_SECONDS = 3
+# 【新功能】自适应轮询：活跃时按最短间隔检查，没有变化时每次把间隔乘以 POLL_SLOWDOWN_FACTOR，直到空闲间隔
+# 直播在有目标开播中、或临近以往开播时刻时保持最短间隔；动态在目标开播中或刚发过动态时保持最短间隔
+# 空闲时段的开播/动态最多晚到空闲间隔这么多秒。按 tools/b_poll_sim.py 的模拟（1~3 个目标），默认的 10 秒/15 秒
+# 让总请求量降到固定 3 秒轮询的 34%~59%：习惯时刻附近的开播仍在 3 秒内检测到，热点外的开播最多晚 10 秒，动态延迟中位数多 0.3~1.8 秒。
+# 调整后可对照日志里“开播检测延迟”“动态检测延迟”的计时统计；想减少直播请求而不增加延迟，可开启下面的直播间广播连接
+LIVE_CHECK_INTERVAL_SECONDS = CHECK_INTERVAL_SECONDS
+LIVE_IDLE_INTERVAL_SECONDS = 10
+DYNAMIC_CHECK_INTERVAL_SECONDS = CHECK_INTERVAL_SECONDS
+DYNAMIC_IDLE_INTERVAL_SECONDS = 15
+POLL_SLOWDOWN_FACTOR = 1.5
+# 以往开播时刻前后多少分钟算作“开播热点时段”，以及记住最近多少次开播时刻
+LIVE_HOT_WINDOW_MINUTES = 30
+LIVE_START_HISTORY_SIZE = 14
+# 发布动态后多少分钟内继续按最短间隔检查该目标的动态（UP 主常常连续发布）
+DYNAMIC_ACTIVE_WINDOW_MINUTES = 30
+
+# 【新功能】直播间广播连接：开启后每个直播目标保持一条弹幕广播 WebSocket，收到开播/下播指令立即推送，
+# HTTP 轮询只作为低频对账（连接全部在线时每 LIVE_RECONCILE_INTERVAL_SECONDS 秒一次），连接断开时自动回到正常轮询
+LIVE_BROADCAST_ENABLED = False
+LIVE_RECONCILE_INTERVAL_SECONDS = 60
+LIVE_BROADCAST_HEARTBEAT_SECONDS = 30
+LIVE_BROADCAST_RECONNECT_SECONDS = 5
+# 调试用：填写后不再向B站查询广播服务器，直接连接这个地址（例如 "ws://127.0.0.1:17800"，配合 `python b.py replay 抓包文件`）
+LIVE_BROADCAST_URL = None
+# 调试用：填写文件名后把收到的每一帧原始数据按行（base64）追加到该文件，可交给 replay 回放
+LIVE_BROADCAST_CAPTURE_FILE = None
+
+# 【新功能】动态接口的请求预算（次/分钟），所有目标共用：目标越多，单个目标的检查间隔越长
+DYNAMIC_REQUESTS_PER_MINUTE = 20
+
+# 【新功能】每个 Cookie 每分钟最多发出的B站 API 请求数（直播和动态合计），超出时请求排队等待
+COOKIE_REQUESTS_PER_MINUTE = 40
+# 【新功能】遇到这些风控错误码（或 HTTP 412）时，当前 Cookie 暂停所有请求：
+# 冷却时间从 BACKOFF_BASE_SECONDS 起每次翻倍，最长 BACKOFF_MAX_SECONDS，并随机抖动，避免到点整齐重试
+RISK_CONTROL_CODES = {-352, -412}
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 1800
+
+# 每类检查的耗时每积累多少个样本输出一次分布
+TIMING_REPORT_EVERY = 100
 
-# 其他配置
-SCREENSHOT_FILE = "temp_dynamic_screenshot.png"
+# 【新功能】截图页面池：预热好的浏览器页面数量，每个页面截图多少次后重建
+SCREENSHOT_POOL_SIZE = 2
+SCREENSHOT_PAGE_MAX_USES = 50
+# 截图时直接拦截的资源类型和域名（视频、埋点统计等动态卡片用不到的内容）
+BLOCKED_RESOURCE_TYPES = {"media", "websocket", "eventsource"}
+BLOCKED_HOSTS = ("data.bilibili.com", "cm.bilibili.com", "api.vc.bilibili.com/session_svr")
+
+# 【新功能】截图发送方式："file" 写成唯一命名的临时文件交给 OneBot 读取，所有群发送完毕后删除；
+# "base64" 直接内嵌在消息里，完全不落盘（OneBot 与本程序不在同一台机器，或以不同用户运行且读不到临时目录时使用）
+SCREENSHOT_SEND_MODE = "file"
+SCREENSHOT_TEMP_DIR = Path(__file__).parent / "temp_screenshots"
+
+# 【新功能】状态文件：动态水位线和直播状态在每次变化后写入，重启时读回，停机期间的动态会被补推
+STATE_FILE = Path(__file__).parent / "b_state.json"
+# 补推的时间上限（小时）：发布时间早于这个范围的动态不再补推；停机超过这么久时，旧的直播状态不再用来判断开播/下播
+CATCHUP_MAX_AGE_HOURS = 6
+# 状态没有变化时，每隔多少秒仍把状态文件重写一次，记录机器人最后一次正常检查的时间
+STATE_HEARTBEAT_SECONDS = 60
 
 # --- 全局变量 ---
-last_state = {
-    "last_dynamic_id": "0", 
-    "last_live_status": -1, 
-    "last_live_title": "", 
-    "last_live_cover_url": ""
-}
-user_name_cache = f"UID:{TARGET_UID}"
+# 【已修改】每个监控目标各自的状态：UID -> 动态水位线、直播状态、标题、封面和名字
+target_states = {}
+# 【新】上次写入状态文件的时间（monotonic），用于状态文件心跳
+state_saved_at = 0.0
+# 【新】每个 Cookie 文件各自的请求预算和风控冷却状态
+cookie_budgets = {}
+# 【新】每个直播目标的广播连接（LIVE_BROADCAST_ENABLED 时创建）：UID -> LiveRoomListener
+live_listeners = {}
+# 【新】每个目标正在进行的动态推送任务，推送未结束时跳过该目标的下一次检查，保证同一目标按顺序推送
+delivery_tasks = {}
+# 【新】全程复用的 httpx 客户端，Cookie 轮换时只更新请求头
+httpx_client = None
+# 【新】截图页面池，浏览器启动后创建
+screenshot_pool = None
 # 【已修改】将Cookie相关状态也放入全局管理
 cookie_state = {
     "current_index": 0,
@@ -92,155 +174,773 @@ def load_and_parse_cookie(file_name):
         print(f"[!] [严重错误] 处理Cookie文件 '{file_name}' 时失败: {e}")
         return None, None
 
+# --- 请求预算与风控退避 ---
+class RiskControlError(Exception):
+    """B站 API 返回了风控错误码，当前 Cookie 已进入冷却"""
+    def __init__(self, code, strikes, cooldown):
+        super().__init__(f"风控错误码 {code}，第 {strikes} 次，暂停请求 {cooldown:.0f} 秒")
+        self.strikes = strikes
+
+def jittered_backoff(base_seconds, attempt, cap_seconds=BACKOFF_MAX_SECONDS):
+    """第 attempt 次失败后的等待时间：从 base_seconds 起指数增长到上限，实际取值在一半到全额之间随机"""
+    delay = min(cap_seconds, base_seconds * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+class CookieBudget:
+    """【新】单个 Cookie 的请求预算：最近 60 秒内至多 COOKIE_REQUESTS_PER_MINUTE 次请求，被风控后整体冷却"""
+    def __init__(self):
+        self.sent = collections.deque()
+        self.cooldown_until = 0.0
+        self.strikes = 0
+
+    def wait_time(self):
+        now = time.monotonic()
+        while self.sent and now - self.sent[0] >= 60: self.sent.popleft()
+        if now < self.cooldown_until: return self.cooldown_until - now
+        if len(self.sent) >= COOKIE_REQUESTS_PER_MINUTE: return 60 - (now - self.sent[0])
+        return 0.0
+
+    def penalize(self):
+        self.strikes += 1
+        cooldown = jittered_backoff(BACKOFF_BASE_SECONDS, self.strikes)
+        self.cooldown_until = time.monotonic() + cooldown
+        return cooldown
+
+def current_cookie_budget():
+    return cookie_budgets.setdefault(COOKIE_FILE_NAMES[cookie_state["current_index"]], CookieBudget())
+
+async def bili_request(client, method, url, **kwargs):
+    """【新】所有B站 API 请求的统一出口：先占用当前 Cookie 的预算（不足时等待），返回解析后的 JSON；
+    遇到风控时让该 Cookie 冷却并抛出 RiskControlError"""
+    while (wait := current_cookie_budget().wait_time()) > 0:
+        # 分段等待，冷却期间轮换了 Cookie 时能立即改用新 Cookie 的预算
+        await asyncio.sleep(min(wait, 5))
+    budget = current_cookie_budget()
+    budget.sent.append(time.monotonic())
+    resp = await client.request(method, url, **kwargs)
+    code = 412 if resp.status_code == 412 else None
+    if code is None:
+        resp.raise_for_status()
+        data = resp.json()
+        code = data.get('code')
+        if code not in RISK_CONTROL_CODES:
+            budget.strikes = 0
+            return data
+    cooldown = budget.penalize()
+    raise RiskControlError(code, budget.strikes, cooldown)
+
+async def report_risk_control(source, e):
+    """风控只在一轮冷却的第一次时通知主群，之后的退避只打印日志"""
+    print(f"[!] [风控] {source}时触发风控: {e}")
+    if e.strikes == 1:
+        error_msg = f"【机器人警告】{source}时触发B站风控，当前Cookie暂停请求并逐步退避。\n{e}"
+        await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
+
+# --- 状态持久化 ---
+def get_target_state(uid):
+    return target_states.setdefault(uid, {
+        "last_dynamic_id": "0",
+        "last_live_status": -1,
+        "last_live_title": "",
+        "last_live_cover_url": "",
+        "name": f"UID:{uid}",
+        "last_dynamic_at": 0,  # 最近一条动态的发布时间，用于判断动态是否活跃
+        "live_start_minutes": [],  # 最近几次开播的时刻（当天第几分钟），用于预测开播热点时段
+        "room_id": 0,  # 直播间号，由直播状态接口得到，广播连接需要
+    })
+
+def save_state():
+    """【新】先写临时文件再原子改名，进程在任何时刻退出都不会留下写了一半的状态文件。
+    saved_at 记录的是机器人最后一次正常运行的时间，由 heartbeat_state 定期刷新"""
+    global state_saved_at
+    temp_path = STATE_FILE.with_suffix(".tmp")
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"targets": {str(uid): state for uid, state in target_states.items()}, "saved_at": time.time()}, f, ensure_ascii=False)
+        os.replace(temp_path, STATE_FILE)
+        state_saved_at = time.monotonic()
+    except OSError as e:
+        print(f"[!] 写入状态文件失败: {e}")
+
+def heartbeat_state():
+    """检查成功后调用：状态长时间没有变化时也重写一次，让 saved_at 反映真实的停机时刻"""
+    if time.monotonic() - state_saved_at >= STATE_HEARTBEAT_SECONDS: save_state()
+
+def load_state():
+    """【新】读回上次的状态，返回成功恢复的 UID 集合；文件不存在或损坏时返回空集合，由调用方重新初始化。
+    动态水位线总是恢复，补推范围由每条动态的发布时间限制；停机超过补推时限时只把直播状态重置为未知，避免推送过时的开播/下播"""
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f: saved = json.load(f)
+    except FileNotFoundError:
+        return set()
+    except (OSError, ValueError) as e:
+        print(f"[!] 读取状态文件失败，将重新初始化: {e}")
+        return set()
+    age_hours = (time.time() - saved.get("saved_at", 0)) / 3600
+    stale_live = age_hours > CATCHUP_MAX_AGE_HOURS
+    if stale_live:
+        print(f"[*] 机器人已停机 {age_hours:.1f} 小时，超过补推时限，直播状态将重新获取。")
+    # 兼容只监控单个目标时的旧格式
+    saved_targets = saved.get("targets") or ({str(TARGET_UID): saved} if "last_dynamic_id" in saved else {})
+    restored = set()
+    for target in TARGETS:
+        saved_state = saved_targets.get(str(target["uid"]))
+        if not saved_state: continue
+        state = get_target_state(target["uid"])
+        for key in state:
+            if key in saved_state: state[key] = saved_state[key]
+        if stale_live: state['last_live_status'] = -1
+        restored.add(target["uid"])
+    print(f"[+] 已从状态文件恢复 {len(restored)}/{len(TARGETS)} 个目标的状态（{age_hours * 60:.0f} 分钟前保存）。")
+    return restored
+
 # --- 截图核心功能 ---
-async def screenshot_dynamic(browser, dynamic_id):
+async def block_unneeded_resources(route):
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(host in request.url for host in BLOCKED_HOSTS):
+        await route.abort()
+    else:
+        await route.continue_()
+
+# mkstemp 建的文件只有属主可读（0600），改回普通 open() 按 umask 得到的权限，OneBot 以其他用户运行时也能读取
+_UMASK = os.umask(0); os.umask(_UMASK)
+SCREENSHOT_FILE_MODE = 0o666 & ~_UMASK
+
+class SpooledImage:
+    """【新】截图的内存副本，带引用计数。
+    创建者持有一个引用；需要文件路径时才写成唯一命名的临时文件，最后一个引用释放后删除"""
+    def __init__(self, data, suffix=".png"):
+        self.data = data
+        self.suffix = suffix
+        self.refs = 1
+        self.path = None
+
+    def acquire(self):
+        self.refs += 1
+        return self
+
+    def release(self):
+        self.refs -= 1
+        if self.refs <= 0 and self.path:
+            try: os.remove(self.path)
+            except OSError: pass
+            self.path = None
+
+    def as_file(self):
+        if self.path is None:
+            SCREENSHOT_TEMP_DIR.mkdir(parents=True, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(dir=SCREENSHOT_TEMP_DIR, prefix="dynamic_", suffix=self.suffix)
+            with os.fdopen(fd, 'wb') as f: f.write(self.data)
+            os.chmod(self.path, SCREENSHOT_FILE_MODE)
+        return self.path
+
+    def to_cq(self):
+        if SCREENSHOT_SEND_MODE == "base64": return f"[CQ:image,file=base64://{base64.b64encode(self.data).decode()}]"
+        return f"[CQ:image,file=file:///{self.as_file()}]"
+
+class PooledPage:
+    def __init__(self, context, page, generation):
+        self.context = context
+        self.page = page
+        self.generation = generation
+        self.uses = 0
+
+class ScreenshotPagePool:
+    """【新】预热好、已带 Cookie 的截图页面池。页面用满 SCREENSHOT_PAGE_MAX_USES 次、截图出错或 Cookie 轮换后会被重建"""
+    def __init__(self, browser, size):
+        self.browser = browser
+        self.size = size
+        self.idle = asyncio.Queue()
+        self.open_pages = 0
+        self.generation = 0  # Cookie 轮换时递增，旧一代的页面归还时即被丢弃
+
+    async def _create(self):
+        generation = self.generation
+        context = await self.browser.new_context(viewport={'width': 800, 'height': 1200}, device_scale_factor=2)
+        try:
+            await context.add_cookies(cookie_state["playwright_cookies"])
+            await context.route("**/*", block_unneeded_resources)
+            page = await context.new_page()
+            # 预热：先打开一次动态首页，让脚本、样式和登录态提前就绪
+            await page.goto("https://t.bilibili.com/", wait_until='domcontentloaded', timeout=30000)
+        except Exception:
+            await context.close()
+            raise
+        return PooledPage(context, page, generation)
+
+    async def _discard(self, entry):
+        self.open_pages -= 1
+        try: await entry.context.close()
+        except Exception: pass
+
+    async def fill(self):
+        """补足页面池，失败时只打印日志，下次取用时会再尝试"""
+        async def add_one():
+            self.open_pages += 1
+            try:
+                self.idle.put_nowait(await self._create())
+            except Exception as e:
+                self.open_pages -= 1
+                print(f"[!] 预热截图页面失败: {e.__class__.__name__}: {e}")
+        await asyncio.gather(*(add_one() for _ in range(self.size - self.open_pages)))
+
+    async def acquire(self):
+        while True:
+            if self.idle.empty() and self.open_pages < self.size:
+                self.open_pages += 1
+                try: return await self._create()
+                except Exception:
+                    self.open_pages -= 1
+                    raise
+            entry = await self.idle.get()
+            if entry.generation == self.generation: return entry
+            await self._discard(entry)
+
+    async def release(self, entry, healthy=True):
+        entry.uses += 1
+        if healthy and entry.uses < SCREENSHOT_PAGE_MAX_USES and entry.generation == self.generation:
+            self.idle.put_nowait(entry)
+            return
+        await self._discard(entry)
+        asyncio.create_task(self.fill())
+
+    def invalidate(self):
+        """Cookie 轮换后调用：现有页面在归还时重建"""
+        self.generation += 1
+        asyncio.create_task(self._drain_idle())
+
+    async def _drain_idle(self):
+        while not self.idle.empty():
+            await self._discard(self.idle.get_nowait())
+        await self.fill()
+
+    async def close(self):
+        while not self.idle.empty():
+            await self._discard(self.idle.get_nowait())
+
+async def screenshot_dynamic(page_pool, dynamic_id):
     dynamic_url = f"https://t.bilibili.com/{dynamic_id}"
-    context = None
+    entry = None
+    healthy = False
+    started = time.monotonic()
     try:
-        context = await browser.new_context(viewport={'width': 800, 'height': 1200}, device_scale_factor=2)
-        await context.add_cookies(cookie_state["playwright_cookies"])
-        page = await context.new_page()
-        await page.goto(dynamic_url, wait_until='networkidle', timeout=30000)
+        entry = await page_pool.acquire()
+        warm = entry.uses > 0
+        page = entry.page
+        await page.goto(dynamic_url, wait_until='domcontentloaded', timeout=30000)
         dynamic_card_selector = ".bili-dyn-item"
-        card_element = await page.wait_for_selector(dynamic_card_selector, timeout=15000)
-        await page.evaluate("""(selector) => {
+        card_element = await page.wait_for_selector(dynamic_card_selector, state='visible', timeout=15000)
+        await page.evaluate("""async (selector) => {
             const uselessSelectors = ['.bili-dyn-action', '.bili-dyn-up-list', '.bili-dyn-seme'];
             uselessSelectors.forEach(s => { const elem = document.querySelector(s); if (elem) elem.style.display = 'none'; });
             const targetElem = document.querySelector(selector);
-            if(targetElem) { targetElem.style.padding = '15px'; targetElem.style.backgroundColor = '#FFFFFF'; }
+            if(targetElem) {
+                targetElem.style.padding = '15px'; targetElem.style.backgroundColor = '#FFFFFF';
+                // 不再等待整页 networkidle，只等卡片内的图片加载完（单张最多等 5 秒）
+                await Promise.all([...targetElem.querySelectorAll('img')].map(img => img.complete ? null :
+                    new Promise(resolve => { img.addEventListener('load', resolve); img.addEventListener('error', resolve); setTimeout(resolve, 5000); })));
+            }
         }""", dynamic_card_selector)
-        await card_element.screenshot(path=SCREENSHOT_FILE)
-        return os.path.abspath(SCREENSHOT_FILE)
+        image = SpooledImage(await card_element.screenshot())
+        healthy = True
+        timings["screenshot_warm" if warm else "screenshot_cold"].record(time.monotonic() - started)
+        return image
     except Exception as e:
         print(f"[!] [严重错误] 截图过程中失败: {e}")
         error_msg = f"【机器人警告】为动态 {dynamic_id} 截图失败。\n错误: {e}"
         await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
         return None
     finally:
-        if context: await context.close()
+        if entry: await page_pool.release(entry, healthy)
 
 # --- OneBot 及其他辅助函数 ---
+class OneBotError(Exception):
+    """OneBot 返回了失败的回执"""
+
+class OneBotConnection:
+    """【新】常驻的 OneBot WebSocket 连接：出站请求排队发送，按 echo 匹配回执，断线后自动重连"""
+    def __init__(self, url):
+        self.url = url
+        self.queue = asyncio.Queue()
+        self.pending = {}  # echo -> 等待回执的 Future
+        self.sent = set()  # 已写入连接、等待回执的 echo
+        self.echo_counter = itertools.count(1)
+        self.task = None
+
+    async def call(self, action, params):
+        """发送一次 OneBot 请求并等待回执，失败时抛出异常"""
+        if self.task is None: self.task = asyncio.create_task(self._run())
+        echo = f"b-{next(self.echo_counter)}"
+        future = asyncio.get_running_loop().create_future()
+        self.pending[echo] = future
+        await self.queue.put((echo, {"action": action, "params": params, "echo": echo}))
+        try:
+            return await asyncio.wait_for(future, ONEBOT_ACK_TIMEOUT_SECONDS)
+        finally:
+            self.pending.pop(echo, None)
+            self.sent.discard(echo)
+
+    async def close(self):
+        task, self.task = self.task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                async with websockets.connect(self.url, open_timeout=10) as websocket:
+                    print(f"[+] 已连接到 OneBot WebSocket: {self.url}")
+                    reader = asyncio.create_task(self._read(websocket))
+                    writer = asyncio.create_task(self._write(websocket))
+                    try:
+                        done, _ = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+                    finally:
+                        # 被 close() 取消时也要收回读写任务，否则它们会继续操作正在关闭的连接，异常无人接收
+                        reader.cancel(); writer.cancel()
+                        await asyncio.gather(reader, writer, return_exceptions=True)
+                    for task in done: task.result()
+            except asyncio.CancelledError:
+                self._fail_pending(ConnectionError("OneBot 连接已关闭"))
+                raise
+            except Exception as e:
+                print(f"[!] [网络错误] OneBot WebSocket 连接中断: {e.__class__.__name__}: {e}，{ONEBOT_RECONNECT_SECONDS} 秒后重连。")
+            # 已发出但尚未收到回执的请求无法确认是否送达，直接按失败处理
+            self._fail_pending(ConnectionError("OneBot 连接中断，未收到回执"), sent_only=True)
+            await asyncio.sleep(ONEBOT_RECONNECT_SECONDS)
+
+    async def _write(self, websocket):
+        while True:
+            echo, payload = await self.queue.get()
+            future = self.pending.get(echo)
+            if future is None or future.done(): continue  # 调用方已超时放弃
+            try:
+                await websocket.send(json.dumps(payload))
+            except Exception as e:
+                if not future.done(): future.set_exception(e)
+                raise
+            self.sent.add(echo)
+
+    async def _read(self, websocket):
+        async for raw in websocket:
+            try: data = json.loads(raw)
+            except ValueError: continue
+            future = self.pending.get(data.get("echo")) if isinstance(data, dict) else None
+            if future is None or future.done(): continue  # 事件上报等与请求无关的消息
+            if data.get("status") == "ok" or data.get("retcode") == 0: future.set_result(data.get("data"))
+            else: future.set_exception(OneBotError(f"retcode={data.get('retcode')} {data.get('wording') or data.get('msg') or ''}".strip()))
+
+    def _fail_pending(self, error, sent_only=False):
+        for echo, future in list(self.pending.items()):
+            if not future.done() and (echo in self.sent or not sent_only): future.set_exception(error)
+
+onebot = OneBotConnection(ONEBOT_WEBSOCKET_URL)
+
 async def send_group_message(group_id, message_parts):
-    if not group_id: return
+    """发送到单个群，收到 OneBot 成功回执时返回 True"""
+    if not group_id: return False
     message_str = ""
     for part in message_parts:
         if part['type'] == 'text': message_str += part['data']['text']
         elif part['type'] == 'image':
             file_path = part['data']['file']
-            if file_path.startswith("http"): message_str += f"[CQ:image,file={file_path}]"
+            if isinstance(file_path, SpooledImage): message_str += file_path.to_cq()
+            elif file_path.startswith("http"): message_str += f"[CQ:image,file={file_path}]"
             elif os.path.exists(file_path): message_str += f"[CQ:image,file=file:///{os.path.abspath(file_path)}]"
     print(f"[+] 准备发送消息到群 {group_id}...")
-    payload = {"action": "send_group_msg", "params": {"group_id": group_id, "message": message_str}}
     try:
-        async with websockets.connect(ONEBOT_WEBSOCKET_URL, open_timeout=10) as websocket:
-            await websocket.send(json.dumps(payload))
-            print(f"[+] 消息已成功发送到 WebSocket。")
+        await onebot.call("send_group_msg", {"group_id": group_id, "message": message_str})
+        print(f"[+] 消息已成功发送到群 {group_id}。")
+        return True
     except Exception as e:
-        print(f"[!] [严重错误] 发送消息到群 {group_id} 失败: {e}.")
+        print(f"[!] [严重错误] 发送消息到群 {group_id} 失败: {e.__class__.__name__}: {e}.")
+        return False
+
+async def broadcast_message(message_parts, group_ids=None):
+    """并发广播“干净”的通知，默认发往主群和所有副群，返回 {群号: 是否成功}"""
+    group_ids = list(dict.fromkeys(g for g in (group_ids or [PUSH_GROUP_ID, *SECONDARY_GROUP_IDS]) if g))
+    started = time.monotonic()
+    spooled = [part['data']['file'] for part in message_parts if part['type'] == 'image' and isinstance(part['data']['file'], SpooledImage)]
+
+    async def send_and_release(group_id):
+        # 每个群各持有一份截图引用，收到该群的回执（或失败）后才释放
+        for image in spooled: image.acquire()
+        try: return await send_group_message(group_id, message_parts)
+        finally:
+            for image in spooled: image.release()
+
+    results = await asyncio.gather(*(send_and_release(group_id) for group_id in group_ids))
+    outcome = dict(zip(group_ids, results))
+    failed = [str(g) for g, ok in outcome.items() if not ok]
+    print(f"[*] 广播完成：{len(group_ids) - len(failed)}/{len(group_ids)} 个群成功，耗时 {time.monotonic() - started:.2f} 秒" + (f"，失败: {', '.join(failed)}" if failed else "。"))
+    return outcome
+
+# --- 计时统计 ---
+class TimingStats:
+    """【新】记录某类检查的耗时样本，每积累一批输出一次分位数"""
+    def __init__(self, name, report_every=TIMING_REPORT_EVERY):
+        self.name = name
+        self.report_every = report_every
+        self.samples = []
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        if len(self.samples) >= self.report_every: self.report()
+
+    def report(self):
+        if not self.samples: return
+        samples, self.samples = sorted(self.samples), []
+        pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+        print(f"[*] [计时] {self.name}: {len(samples)} 次，中位数 {pick(0.5):.2f}s，P90 {pick(0.9):.2f}s，最大 {samples[-1]:.2f}s")
+
+timings = {
+    "live": TimingStats("直播检查耗时"),
+    "dynamic": TimingStats("动态检查耗时"),
+    "live_detect": TimingStats("开播检测延迟", report_every=10),
+    "dynamic_detect": TimingStats("动态检测延迟", report_every=10),
+    "screenshot_cold": TimingStats("截图耗时（新页面）", report_every=10),
+    "screenshot_warm": TimingStats("截图耗时（复用页面）", report_every=10),
+}
 
-async def broadcast_message(message_parts):
-    """向主群和所有副群广播“干净”的通知"""
-    await send_group_message(PUSH_GROUP_ID, message_parts)
-    for group_id in SECONDARY_GROUP_IDS:
-        await send_group_message(group_id, message_parts)
+def record_detection_latency(name, published_at):
+    """记录从开播/发布到被检测到的延迟（published_at 为 Unix 时间戳）"""
+    if not published_at: return
+    latency = time.time() - published_at
+    print(f"[*] [计时] {timings[name].name}: {latency:.1f}s")
+    timings[name].record(latency)
 
 # --- 核心检查逻辑 ---
 
 async def check_live_status(httpx_client):
-    """检查直播状态，并按分流规则推送到群组。"""
-    global last_state, user_name_cache
-    print(f"[*] 开始检查直播间状态...")
-    live_api_url = f"https://api.live.bilibili.com/room/v1/Room/get_info?room_id={TARGET_LIVE_ROOM_ID}"
+    """【已修改】一次批量请求查出所有目标的直播状态，并按各目标的分流规则推送。检查失败时返回 False"""
+    live_targets = [target for target in TARGETS if target.get("live", True)]
+    if not live_targets: return True
+    print(f"[*] 开始检查 {len(live_targets)} 个直播间状态...")
+    live_api_url = "https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids"
     try:
-        resp = await httpx_client.get(live_api_url)
-        resp.raise_for_status()
-        live_data = resp.json()
+        live_data = await bili_request(httpx_client, "POST", live_api_url, json={"uids": [target["uid"] for target in live_targets]})
         if live_data.get('code') != 0: raise Exception(f"API返回错误: {live_data.get('message', '未知')}")
-        info = live_data['data']
-        user_name_cache = info.get('uname', user_name_cache)
-        current_status = info.get('live_status', 0)
-        
-        if current_status != last_state['last_live_status']:
-            message_parts = []
-            if current_status == 1 and last_state['last_live_status'] != 1:
-                print(f"[+] 检测到 {user_name_cache} 开播了！")
-                last_state['last_live_title'] = info.get('title', '')
-                last_state['last_live_cover_url'] = info.get('user_cover', '')
-                message_parts = [
-                    {'type': 'text', 'data': {'text': f"{user_name_cache}开播了"}},
-                    {'type': 'image', 'data': {'file': last_state['last_live_cover_url']}}
-                ]
-            elif current_status != 1 and last_state['last_live_status'] == 1:
-                print(f"[+] 检测到 {user_name_cache} 下播了。")
-                message_parts = [
-                    {'type': 'text', 'data': {'text': f"{user_name_cache}下播了"}},
-                    {'type': 'image', 'data': {'file': last_state['last_live_cover_url']}}
-                ]
-            if message_parts:
-                await broadcast_message(message_parts)
-            last_state['last_live_status'] = current_status
-        else:
-            print("[*] 直播状态未变化。")
+        rooms = live_data.get('data') or {}  # 没有任何直播间时接口返回空列表
+        for target in live_targets:
+            info = rooms.get(str(target["uid"]))
+            if info: await apply_live_status(target, info)
+        return True
             
+    except RiskControlError as e:
+        await report_risk_control("获取直播状态", e)
     except (httpx.ConnectError, httpx.ReadTimeout) as e:
         print(f"[!] [网络错误] 获取直播状态时发生可恢复的网络错误，已跳过本次检查: {e.__class__.__name__}")
     except Exception as e:
         error_msg = f"【机器人故障】获取直播状态失败。\n错误: {e.__class__.__name__}: {e}"
         print(f"[!] {error_msg}")
         await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
+    return False
+
+async def apply_live_status(target, info):
+    """比较单个目标的直播状态，开播/下播时推送到该目标的群。
+    轮询和广播连接都会调用这里：状态在推送前就更新，同一次开播/下播只会推送一次"""
+    state = get_target_state(target["uid"])
+    state['name'] = info.get('uname') or state['name']
+    state['room_id'] = info.get('room_id') or state['room_id']
+    current_status = info.get('live_status', 0)
+    if current_status == state['last_live_status']: return
+    message_parts = []
+    if current_status == 1 and state['last_live_status'] != 1:
+        print(f"[+] 检测到 {state['name']} 开播了！")
+        if state['last_live_status'] != -1: record_detection_latency("live_detect", info.get('live_time'))
+        started = time.localtime(info.get('live_time') or time.time())
+        state['live_start_minutes'] = (state['live_start_minutes'] + [started.tm_hour * 60 + started.tm_min])[-LIVE_START_HISTORY_SIZE:]
+        state['last_live_title'] = info.get('title', '')
+        state['last_live_cover_url'] = info.get('cover_from_user', '')
+        message_parts = [
+            {'type': 'text', 'data': {'text': f"{state['name']}开播了"}},
+            {'type': 'image', 'data': {'file': state['last_live_cover_url']}}
+        ]
+    elif current_status != 1 and state['last_live_status'] == 1:
+        print(f"[+] 检测到 {state['name']} 下播了。")
+        message_parts = [
+            {'type': 'text', 'data': {'text': f"{state['name']}下播了"}},
+            {'type': 'image', 'data': {'file': state['last_live_cover_url']}}
+        ]
+    state['last_live_status'] = current_status
+    save_state()
+    if message_parts:
+        await broadcast_message(message_parts, target.get("groups"))
+
+async def deliver_new_dynamics(page_pool, target, new_items):
+    """【新】按发布顺序推送某个目标水位线之后的所有动态。
+    截图提前并发进行（并发数受截图页面池大小限制），推送严格按顺序；每条推送完成后才推进水位线，
+    一条都没送达时停在这里，下次检查重试它和之后的动态"""
+    state = get_target_state(target["uid"])
+    screenshot_tasks = [asyncio.create_task(screenshot_dynamic(page_pool, item['id_str'])) for item in new_items]
+    delivered = 0
+    try:
+        for item, task in zip(new_items, screenshot_tasks):
+            dynamic_id = item['id_str']
+            author = item.get('modules', {}).get('module_author', {})
+            record_detection_latency("dynamic_detect", author.get('pub_ts'))
+            state['name'] = author.get('name') or state['name']
+            state['last_dynamic_at'] = max(state['last_dynamic_at'], author.get('pub_ts') or time.time())
+            message_text = f"{state['name']}发布了新视频" if item.get('type') == 'DYNAMIC_TYPE_AV' else f"{state['name']}发布了新动态"
+            message_parts = [{'type': 'text', 'data': {'text': message_text}}]
+            screenshot = await task
+            delivered += 1
+            if screenshot: message_parts.append({'type': 'image', 'data': {'file': screenshot}})
+            try: outcome = await broadcast_message(message_parts, target.get("groups"))
+            finally:
+                if screenshot: screenshot.release()
+            if outcome and not any(outcome.values()):
+                print(f"[!] 动态 {dynamic_id} 未能送达任何群，将在下次检查时重试。")
+                return
+            state['last_dynamic_id'] = dynamic_id
+            save_state()
+    except Exception as e:
+        error_msg = f"【机器人故障】推送 {state['name']} 的动态失败。\n错误: {e.__class__.__name__}: {e}"
+        print(f"[!] {error_msg}")
+        await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
+    finally:
+        # 提前结束时取消还没用上的截图，已完成的截图直接释放
+        for task in screenshot_tasks[delivered:]:
+            if not task.done(): task.cancel()
+            elif not task.cancelled() and task.exception() is None and task.result(): task.result().release()
 
-async def check_dynamics(httpx_client, browser, is_initial_check=False):
-    """检查B站动态，按分流规则推送到群组。"""
-    global last_state, user_name_cache
-    print(f"[*] 开始检查动态...")
+async def check_dynamics(httpx_client, page_pool, target, is_initial_check=False):
+    """检查单个目标的B站动态，新动态交给后台按顺序推送到该目标的群。检查失败时返回 False"""
+    uid = target["uid"]
+    state = get_target_state(uid)
+    pending_delivery = delivery_tasks.get(uid)
+    if pending_delivery and not pending_delivery.done():
+        print(f"[*] {state['name']} 的上一批动态仍在推送，本轮跳过。")
+        return True
+    print(f"[*] 开始检查 {state['name']} 的动态...")
     try:
-        dynamic_api_url = f"https://api.bilibili.com/x/polymer/web-dynamic/v1/feed/space?host_mid={TARGET_UID}"
-        resp_dynamic = await httpx_client.get(dynamic_api_url)
-        resp_dynamic.raise_for_status()
-        dynamic_data = resp_dynamic.json()
+        dynamic_api_url = f"https://api.bilibili.com/x/polymer/web-dynamic/v1/feed/space?host_mid={uid}"
+        dynamic_data = await bili_request(httpx_client, "GET", dynamic_api_url)
         if dynamic_data.get('code') != 0 or not dynamic_data.get('data', {}).get('items'):
             raise Exception(f"API返回错误: {dynamic_data.get('message', '未知')}")
         items = dynamic_data['data']['items']
-        if not items: return
-        first_item = items[0]
-        is_pinned = first_item.get('modules', {}).get('module_tag', {}).get('text') == '置顶'
-        target_dynamic = items[1] if is_pinned and len(items) > 1 else first_item if not is_pinned else None
-        if not target_dynamic:
-            if is_pinned and is_initial_check: last_state['last_dynamic_id'] = first_item['id_str']
-            return
-        current_dynamic_id = target_dynamic['id_str']
+        if not items: return True
+        # 置顶动态也按ID比较：旧的置顶ID必然不高于水位线，不会被重复推送
         if is_initial_check:
-            last_state['last_dynamic_id'] = current_dynamic_id
-            print(f"[*] 初始化完成，最新动态ID记录为: {current_dynamic_id}")
-            return
-        if int(current_dynamic_id) > int(last_state['last_dynamic_id']):
-            print(f"[+] 发现新动态！ID: {current_dynamic_id}")
-            last_state['last_dynamic_id'] = current_dynamic_id
-            user_name_cache = target_dynamic.get('modules', {}).get('module_author', {}).get('name', user_name_cache)
-            dyn_type = target_dynamic.get('type')
-            message_text = f"{user_name_cache}发布了新视频" if dyn_type == 'DYNAMIC_TYPE_AV' else f"{user_name_cache}发布了新动态"
-            screenshot_path = await screenshot_dynamic(browser, current_dynamic_id)
-            message_parts = [{'type': 'text', 'data': {'text': message_text}}]
-            if screenshot_path:
-                message_parts.append({'type': 'image', 'data': {'file': screenshot_path}})
-                await broadcast_message(message_parts)
-                try: os.remove(screenshot_path)
-                except OSError: pass
-            else:
-                await broadcast_message(message_parts)
+            state['last_dynamic_id'] = max((item['id_str'] for item in items), key=int)
+            state['last_dynamic_at'] = max(item.get('modules', {}).get('module_author', {}).get('pub_ts') or 0 for item in items)
+            save_state()
+            print(f"[*] 初始化完成，{state['name']} 的最新动态ID记录为: {state['last_dynamic_id']}")
+            return True
+        watermark = int(state['last_dynamic_id'])
+        new_items = sorted((item for item in items if int(item['id_str']) > watermark), key=lambda item: int(item['id_str']))
+        # 停机太久时，发布时间超出补推范围的旧动态直接越过，不再推送
+        cutoff = time.time() - CATCHUP_MAX_AGE_HOURS * 3600
+        expired = [item for item in new_items if (item.get('modules', {}).get('module_author', {}).get('pub_ts') or cutoff) < cutoff]
+        if expired:
+            print(f"[*] 跳过 {len(expired)} 条超过 {CATCHUP_MAX_AGE_HOURS} 小时的旧动态。")
+            new_items = [item for item in new_items if item not in expired]
+            state['last_dynamic_id'] = max((item['id_str'] for item in expired), key=int)
+            save_state()
+        if new_items:
+            print(f"[+] 发现 {len(new_items)} 条新动态！ID: {', '.join(item['id_str'] for item in new_items)}")
+            delivery_tasks[uid] = asyncio.create_task(deliver_new_dynamics(page_pool, target, new_items))
         else:
             print("[*] 动态ID未变化。")
+        return True
 
+    except RiskControlError as e:
+        await report_risk_control(f"获取 {state['name']} 的B站动态", e)
     except (httpx.ConnectError, httpx.ReadTimeout) as e:
         print(f"[!] [网络错误] 获取B站动态时发生可恢复的网络错误，已跳过本次检查: {e.__class__.__name__}")
     except Exception as e:
-        error_msg = f"【机器人故障】获取B站动态失败。\n错误: {e.__class__.__name__}: {e}"
+        error_msg = f"【机器人故障】获取 {state['name']} 的B站动态失败。\n错误: {e.__class__.__name__}: {e}"
         print(f"[!] {error_msg}")
         await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
+    return False
+
+def dynamic_poll_spacing():
+    """【新】相邻两次动态请求的最小间隔，保证所有目标合计不超过每分钟预算"""
+    return 60 / DYNAMIC_REQUESTS_PER_MINUTE
+
+# --- 自适应轮询调度 ---
+class AdaptiveInterval:
+    """【新】单个轮询源的检查间隔：活跃时回到最短间隔，没有变化时逐步放宽到空闲间隔，失败时带抖动地指数退避"""
+    def __init__(self, min_seconds, idle_seconds):
+        self.min_seconds = min_seconds
+        self.idle_seconds = idle_seconds
+        self.current = min_seconds
+        self.failures = 0
+
+    def next_delay(self, active, ok=True):
+        if not ok:
+            self.failures += 1
+            return jittered_backoff(self.current, self.failures, max(self.idle_seconds, BACKOFF_BASE_SECONDS))
+        self.failures = 0
+        self.current = self.min_seconds if active else min(self.idle_seconds, self.current * POLL_SLOWDOWN_FACTOR)
+        return self.current
+
+def live_is_hot():
+    """直播是否需要按最短间隔检查：有目标正在直播（等它下播），或现在接近某个目标以往的开播时刻"""
+    now = time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    for target in TARGETS:
+        if not target.get("live", True): continue
+        state = get_target_state(target["uid"])
+        if state['last_live_status'] == 1: return True
+        if any(min(abs(minute - m), 1440 - abs(minute - m)) <= LIVE_HOT_WINDOW_MINUTES for m in state['live_start_minutes']): return True
+    return False
+
+def dynamic_is_active(target):
+    """目标的动态是否需要按最短间隔检查：正在直播，或刚发过动态"""
+    state = get_target_state(target["uid"])
+    return state['last_live_status'] == 1 or time.time() - state['last_dynamic_at'] < DYNAMIC_ACTIVE_WINDOW_MINUTES * 60
+
+# --- 直播间广播连接 ---
+# 数据包头：总长度、头长度、协议版本、操作码、序号（大端）
+PACKET_HEADER = struct.Struct(">IHHII")
+OP_HEARTBEAT, OP_HEARTBEAT_REPLY, OP_COMMAND, OP_AUTH, OP_AUTH_REPLY = 2, 3, 5, 7, 8
+PROTOVER_ZLIB, PROTOVER_BROTLI = 2, 3
+
+def encode_packet(operation, body=b"", protover=1):
+    if isinstance(body, str): body = body.encode()
+    return PACKET_HEADER.pack(PACKET_HEADER.size + len(body), PACKET_HEADER.size, protover, operation, 1) + body
+
+def decode_packets(data):
+    """拆开一帧里的所有数据包，压缩包解压后递归拆分，依次产出 (操作码, 包体)"""
+    offset = 0
+    while offset + PACKET_HEADER.size <= len(data):
+        length, header_length, protover, operation, _ = PACKET_HEADER.unpack_from(data, offset)
+        if length < header_length: break  # 损坏的包，丢弃这一帧剩余部分
+        body = data[offset + header_length:offset + length]
+        offset += length
+        if protover == PROTOVER_ZLIB: yield from decode_packets(zlib.decompress(body))
+        elif protover == PROTOVER_BROTLI: yield from decode_packets(brotli.decompress(body))
+        else: yield operation, body
+
+def cookie_value(name):
+    return next((c['value'] for c in cookie_state["playwright_cookies"] or [] if c.get('name') == name), None)
+
+async def fetch_live_info(uid):
+    """单独查一次某个目标的直播间信息（标题、封面），失败时返回空字典"""
+    try:
+        data = await bili_request(httpx_client, "POST", "https://api.live.bilibili.com/room/v1/Room/get_status_info_by_uids", json={"uids": [uid]})
+        return ((data.get('data') or {}).get(str(uid)) or {}) if data.get('code') == 0 else {}
+    except Exception as e:
+        print(f"[!] 获取 UID:{uid} 的直播间信息失败: {e.__class__.__name__}: {e}")
+        return {}
+
+class LiveRoomListener:
+    """【新】单个直播间的弹幕广播连接：收到 LIVE/PREPARING 指令立即更新开播状态，断线后自动重连"""
+    def __init__(self, target, url=None):
+        self.target = target
+        self.url = url  # 为空时通过 getDanmuInfo 获取广播服务器地址和令牌
+        self.connected = False
+        self.task = None
+
+    def start(self):
+        if self.task is None: self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task: self.task.cancel()
+        self.task = None
+
+    async def _endpoint(self, room_id):
+        auth = {"uid": 0, "roomid": room_id, "protover": PROTOVER_BROTLI if brotli else PROTOVER_ZLIB, "platform": "web", "type": 2}
+        if self.url: return self.url, auth
+        data = await bili_request(httpx_client, "GET", "https://api.live.bilibili.com/xlive/web-room/v1/index/getDanmuInfo", params={"id": room_id, "type": 0})
+        if data.get('code') != 0: raise Exception(f"获取广播服务器失败: {data.get('message', '未知')}")
+        host = data['data']['host_list'][0]
+        auth.update(uid=int(cookie_value("DedeUserID") or 0), key=data['data']['token'], buvid=cookie_value("buvid3") or "")
+        return f"wss://{host['host']}:{host['wss_port']}/sub", auth
+
+    async def _run(self):
+        state = get_target_state(self.target["uid"])
+        while True:
+            try:
+                # 房间号来自第一次直播状态检查
+                while not state['room_id']: await asyncio.sleep(LIVE_CHECK_INTERVAL_SECONDS)
+                url, auth = await self._endpoint(state['room_id'])
+                async with websockets.connect(url, open_timeout=10, max_size=None) as websocket:
+                    await websocket.send(encode_packet(OP_AUTH, json.dumps(auth)))
+                    for operation, body in decode_packets(await asyncio.wait_for(websocket.recv(), 10)):
+                        if operation == OP_AUTH_REPLY and json.loads(body).get('code') != 0: raise Exception(f"认证失败: {body!r}")
+                    self.connected = True
+                    print(f"[+] 已连接 {state['name']} 的直播间广播（房间 {state['room_id']}）。")
+                    heartbeat = asyncio.create_task(self._heartbeat(websocket))
+                    try:
+                        async for frame in websocket:
+                            if isinstance(frame, str): continue
+                            capture_frame(frame)
+                            for operation, body in decode_packets(frame):
+                                if operation != OP_COMMAND: continue
+                                try: message = json.loads(body)
+                                except ValueError: continue
+                                await self._on_command(message)
+                    finally:
+                        heartbeat.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[!] [网络错误] {state['name']} 的直播间广播连接中断: {e.__class__.__name__}: {e}，{LIVE_BROADCAST_RECONNECT_SECONDS} 秒后重连，期间由轮询检测。")
+            finally:
+                self.connected = False
+            await asyncio.sleep(LIVE_BROADCAST_RECONNECT_SECONDS)
+
+    async def _heartbeat(self, websocket):
+        while True:
+            await websocket.send(encode_packet(OP_HEARTBEAT, "[object Object]"))
+            await asyncio.sleep(LIVE_BROADCAST_HEARTBEAT_SECONDS)
+
+    async def _on_command(self, message):
+        cmd = message.get('cmd', '').split(':')[0]
+        if cmd not in ("LIVE", "PREPARING", "ROUND"): return
+        state = get_target_state(self.target["uid"])
+        print(f"[*] 收到 {state['name']} 的直播间广播指令: {cmd}")
+        if cmd == "LIVE":
+            if state['last_live_status'] == 1: return  # 同一次开播会收到多条 LIVE
+            # 广播里没有标题和封面，查不到时沿用上次开播的
+            info = {'title': state['last_live_title'], 'cover_from_user': state['last_live_cover_url'], **await fetch_live_info(self.target["uid"])}
+            info.update(live_status=1, live_time=message.get('live_time') or info.get('live_time') or time.time())
+        else:
+            info = {'live_status': 2 if cmd == "ROUND" else 0}
+        await apply_live_status(self.target, info)
+
+def capture_frame(frame):
+    if not LIVE_BROADCAST_CAPTURE_FILE: return
+    with open(Path(__file__).parent / LIVE_BROADCAST_CAPTURE_FILE, 'a', encoding='utf-8') as f:
+        f.write(base64.b64encode(frame).decode() + "\n")
+
+def broadcast_covers_live_targets():
+    """所有直播目标的广播连接都在线时，HTTP 轮询只需低频对账"""
+    live_targets = [target for target in TARGETS if target.get("live", True)]
+    return bool(live_targets) and all(target["uid"] in live_listeners and live_listeners[target["uid"]].connected for target in live_targets)
+
+async def serve_broadcast_replay(capture_path, port=17800, frame_interval=1.0):
+    """【新】本地广播桩服务器：认证后按顺序回放抓包文件里的每一帧，并回应心跳，用于离线测试 LiveRoomListener"""
+    with open(capture_path, 'r', encoding='utf-8') as f:
+        frames = [base64.b64decode(line) for line in f if line.strip()]
+
+    async def handler(websocket, *_):
+        print(f"[*] 回放连接已建立，认证包: {list(decode_packets(await websocket.recv()))}")
+        await websocket.send(encode_packet(OP_AUTH_REPLY, '{"code":0}'))
+
+        async def answer_heartbeats():
+            async for frame in websocket:
+                if any(operation == OP_HEARTBEAT for operation, _ in decode_packets(frame)):
+                    await websocket.send(encode_packet(OP_HEARTBEAT_REPLY, struct.pack(">I", 1)))
+        responder = asyncio.create_task(answer_heartbeats())
+        try:
+            for frame in frames:
+                await asyncio.sleep(frame_interval)
+                await websocket.send(frame)
+            print(f"[*] 已回放 {len(frames)} 帧，保持连接。")
+            await responder
+        finally:
+            responder.cancel()
+
+    async with websockets.serve(handler, "127.0.0.1", port):
+        print(f"[*] 广播回放服务器已在 ws://127.0.0.1:{port} 启动，共 {len(frames)} 帧。")
+        await asyncio.Future()
 
 # --- 主程序入口 ---
 async def manage_cookie_rotation():
-    """【新】检查是否需要轮换Cookie，并执行轮换操作"""
+    """【新】检查是否需要轮换Cookie，并执行轮换操作，同时更新常驻 httpx 客户端的请求头"""
     global cookie_state
     
     # 如果只有一个cookie文件，则无需轮换
@@ -268,6 +968,8 @@ async def manage_cookie_rotation():
         cookie_state["playwright_cookies"] = new_playwright_cookies
         cookie_state["httpx_headers"]['Cookie'] = new_httpx_cookie_str
         cookie_state["last_switch_time"] = time.time()
+        if httpx_client: httpx_client.headers['Cookie'] = new_httpx_cookie_str
+        if screenshot_pool: screenshot_pool.invalidate()
         
         success_msg = f"【机器人通知】已自动轮换至下一个Cookie: `{next_cookie_file}`"
         print(f"[+] {success_msg}")
@@ -283,7 +985,67 @@ async def manage_cookie_rotation():
     print("*"*10 + " Cookie轮换流程结束 " + "*"*10 + "\n")
 
 
+async def reset_httpx_client():
+    """创建（或重建）常驻的 httpx 客户端"""
+    global httpx_client
+    if httpx_client: await httpx_client.aclose()
+    httpx_client = httpx.AsyncClient(headers=cookie_state["httpx_headers"], timeout=15.0,
+                                     limits=httpx.Limits(max_connections=10, max_keepalive_connections=5))
+
+async def run_check(name, check):
+    """执行一次检查并记录耗时，兜住检查函数自身没有处理的异常；返回检查是否成功"""
+    started = time.monotonic()
+    ok = False
+    try:
+        ok = await check(httpx_client)
+    except httpx.PoolTimeout as e:
+        error_msg = '【机器人严重故障】网络连接池超时，我将自动尝试重置连接并继续。如果此问题频繁出现，请检查服务器网络环境。'
+        print(f"[!] [严重网络错误] {error_msg} 错误: {e}")
+        await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
+        await reset_httpx_client()
+    except Exception as e:
+        error_msg = f"【机器人严重故障】轮询循环发生意外错误，机器人将继续运行。\n错误: {e.__class__.__name__}: {e}"
+        print(f"[!] {error_msg}")
+        await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
+    timings[name].record(time.monotonic() - started)
+    if ok: heartbeat_state()
+    return ok
+
+async def live_poll_loop():
+    """【已修改】直播批量检查，间隔随是否处于开播热点时段自适应，慢的动态接口不会拖慢开播检测；
+    广播连接全部在线时退为低频对账，连接断开后的下一轮起恢复正常间隔"""
+    schedule = AdaptiveInterval(LIVE_CHECK_INTERVAL_SECONDS, LIVE_IDLE_INTERVAL_SECONDS)
+    while True:
+        started = time.monotonic()
+        ok = await run_check("live", check_live_status)
+        delay = schedule.next_delay(live_is_hot(), ok)
+        # 分段等待，广播连接中途断开时不必等满对账间隔
+        while (remaining := (LIVE_RECONCILE_INTERVAL_SECONDS if broadcast_covers_live_targets() else delay) - (time.monotonic() - started)) > 0:
+            await asyncio.sleep(min(remaining, LIVE_CHECK_INTERVAL_SECONDS))
+
+async def dynamic_poll_loop(page_pool):
+    """【已修改】每个目标各有自己的自适应间隔，每次检查到期最早的目标；相邻两次请求至少相隔 dynamic_poll_spacing() 秒"""
+    schedules = {target["uid"]: AdaptiveInterval(DYNAMIC_CHECK_INTERVAL_SECONDS, DYNAMIC_IDLE_INTERVAL_SECONDS) for target in TARGETS}
+    spacing = dynamic_poll_spacing()
+    now = time.monotonic()
+    due = {target["uid"]: now + i * spacing for i, target in enumerate(TARGETS)}
+    last_started = now - spacing
+    while True:
+        target = min(TARGETS, key=lambda t: due[t["uid"]])
+        uid = target["uid"]
+        now = time.monotonic()
+        await asyncio.sleep(max(0.0, due[uid] - now, last_started + spacing - now))
+        last_started = time.monotonic()
+        ok = await run_check("dynamic", lambda client: check_dynamics(client, page_pool, target))
+        due[uid] = last_started + schedules[uid].next_delay(dynamic_is_active(target), ok)
+
+async def cookie_rotation_loop():
+    while True:
+        await asyncio.sleep(60)
+        await manage_cookie_rotation()
+
 async def main():
+    global screenshot_pool
     # 初始化加载第一个Cookie
     initial_cookie_file = COOKIE_FILE_NAMES[0]
     p_cookies, h_cookie_str = load_and_parse_cookie(initial_cookie_file)
@@ -293,49 +1055,56 @@ async def main():
     cookie_state["playwright_cookies"] = p_cookies
     cookie_state["httpx_headers"]['Cookie'] = h_cookie_str
     print(f"[*] 初始Cookie '{initial_cookie_file}' 已成功加载并配置。")
+    # 清理上次异常退出时残留的截图临时文件
+    if SCREENSHOT_TEMP_DIR.is_dir():
+        for leftover in SCREENSHOT_TEMP_DIR.glob("dynamic_*"): leftover.unlink(missing_ok=True)
+    await reset_httpx_client()
     
-    async with async_playwright() as p:
-        print("[*] 正在启动浏览器内核...")
-        browser = await p.chromium.launch()
-        print("[+] 浏览器内核启动成功。")
-        print(f"\n[*] 机器人开始工作，将每隔 {CHECK_INTERVAL_SECONDS} 秒检查一次。")
-        
-        # 首次启动不推送，只记录初始状态
-        print("\n" + "="*50 + f"\n[*] {time.strftime('%Y-%m-%d %H:%M:%S')} - 开始首次状态初始化")
-        async with httpx.AsyncClient(headers=cookie_state["httpx_headers"], timeout=15.0) as httpx_client:
-            await check_live_status(httpx_client)
-            await check_dynamics(httpx_client, browser, is_initial_check=True)
-        print("="*50)
-        
-        while True:
-            await asyncio.sleep(CHECK_INTERVAL_SECONDS)
-            
-            # 在每次大循环开始时，检查是否需要轮换Cookie
-            await manage_cookie_rotation()
-            
-            print("\n" + "="*50 + f"\n[*] {time.strftime('%Y-%m-%d %H:%M:%S')} - 开始新一轮检查")
-            try:
-                # 使用当前激活的httpx_headers
-                async with httpx.AsyncClient(headers=cookie_state["httpx_headers"], timeout=15.0) as httpx_client:
-                    await check_live_status(httpx_client)
-                    await check_dynamics(httpx_client, browser)
-            
-            except httpx.PoolTimeout as e:
-                error_msg = '【机器人严重故障】网络连接池超时，我将自动尝试重置连接并继续。如果此问题频繁出现，请检查服务器网络环境。'
-                print(f"[!] [严重网络错误] {error_msg} 错误: {e}")
-                await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
+    try:
+        async with async_playwright() as p:
+            print("[*] 正在启动浏览器内核...")
+            browser = await p.chromium.launch()
+            print("[+] 浏览器内核启动成功。")
+            screenshot_pool = ScreenshotPagePool(browser, SCREENSHOT_POOL_SIZE)
+            await screenshot_pool.fill()
+            print(f"[+] 已预热 {screenshot_pool.open_pages} 个截图页面。")
             
-            except Exception as e:
-                error_msg = f"【机器人严重故障】主循环发生意外错误，机器人将继续运行。\n错误: {e.__class__.__name__}: {e}"
-                print(f"[!] {error_msg}")
-                await send_group_message(PUSH_GROUP_ID, [{'type': 'text', 'data': {'text': error_msg}}])
-            finally:
+            # 有近期状态的目标直接从上次的位置继续，其余目标首次启动不推送动态，只记录初始状态
+            restored = load_state()
+            new_targets = [target for target in TARGETS if target["uid"] not in restored]
+            if new_targets:
+                print("\n" + "="*50 + f"\n[*] {time.strftime('%Y-%m-%d %H:%M:%S')} - 开始首次状态初始化（{len(new_targets)} 个目标）")
+                async def init_dynamics():
+                    for i, target in enumerate(new_targets):
+                        if i: await asyncio.sleep(dynamic_poll_spacing())
+                        await check_dynamics(httpx_client, screenshot_pool, target, is_initial_check=True)
+                await asyncio.gather(check_live_status(httpx_client), init_dynamics())
                 print("="*50)
-                
-        await browser.close()
+            
+            if LIVE_BROADCAST_ENABLED:
+                for target in TARGETS:
+                    if not target.get("live", True): continue
+                    live_listeners[target["uid"]] = LiveRoomListener(target, LIVE_BROADCAST_URL)
+                    live_listeners[target["uid"]].start()
+                print(f"[*] 已开启 {len(live_listeners)} 个直播间广播连接，连接在线时直播轮询降为每 {LIVE_RECONCILE_INTERVAL_SECONDS} 秒对账一次。")
+
+            print(f"\n[*] 机器人开始工作，监控 {len(TARGETS)} 个目标：直播每 {LIVE_CHECK_INTERVAL_SECONDS}~{LIVE_IDLE_INTERVAL_SECONDS} 秒批量检查一次，"
+                  f"每个目标的动态每 {DYNAMIC_CHECK_INTERVAL_SECONDS}~{DYNAMIC_IDLE_INTERVAL_SECONDS} 秒检查一次（越活跃越频繁），"
+                  f"每个Cookie每分钟至多 {COOKIE_REQUESTS_PER_MINUTE} 次请求。")
+            await asyncio.gather(
+                live_poll_loop(),
+                dynamic_poll_loop(screenshot_pool),
+                cookie_rotation_loop(),
+            )
+    finally:
+        for listener in live_listeners.values(): await listener.close()
+        if httpx_client: await httpx_client.aclose()
+        await onebot.close()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        # python b.py replay 抓包文件 [端口]：启动本地广播回放服务器，配合 LIVE_BROADCAST_URL 测试广播连接
+        if sys.argv[1:2] == ["replay"]: asyncio.run(serve_broadcast_replay(sys.argv[2], *map(int, sys.argv[3:4])))
+        else: asyncio.run(main())
     except KeyboardInterrupt:
         print("\n[*] 机器人已手动停止。")
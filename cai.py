@@ -1,12 +1,25 @@
 import asyncio
+import heapq
+import itertools
 import json
+import math
 import os
 import random
 import re
+import sqlite3
+import threading
+import time
+import unicodedata
 import websockets
-import requests
+import httpx
 import logging
-from collections import defaultdict
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pilk  # 可选依赖，仅完整音频截取模式需要，用于把 PCM 编码成 silk
+except ImportError:
+    pilk = None
 
 # --- 基本配置 ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -14,29 +27,80 @@ ONEBOT_WS_URL = "ws://127.0.0.1:15000"
 ONEBOT_HTTP_API_URL = "http://127.0.0.1:15100"
 LYRIC_TRIGGER_COMMAND = "看词猜鹿歌"
 AUDIO_TRIGGER_COMMAND = "听音猜鹿歌"
+REPORT_COMMAND = "鹿歌题库报告"
+LEADERBOARD_COMMAND = "鹿歌排行"
+SEARCH_COMMAND = "搜鹿歌词"
 LRC_FOLDER = "lrc"
 SLK_FOLDER = "slk"
+ALIAS_FILE = "aliases.json"  # 可选，格式为 {"歌名": ["别名1", "别名2"]}
+LYRIC_INDEX_FILE = "lyric_index.json"
+SEARCH_RESULT_LIMIT = 10
 ANSWER_TIME_SECONDS = 120 
+SEND_TIMEOUT_SECONDS = 10
+SEND_POOL_CONNECTIONS = 20
+CATALOG_REFRESH_SECONDS = 30
+TIMER_TICK_SECONDS = 0.5
+QUIZ_PREFETCH_DEPTH = 3
+SCORE_DB_FILE = "scores.db"
+SCORE_FLUSH_SECONDS = 5
+SCORE_FLUSH_BATCH = 50
+LEADERBOARD_SIZE = 10
+
+# --- 完整音频截取模式（可选） ---
+# 开启后听音猜鹿歌不再使用 slk/ 里手工切好的片段，而是从 source/ 里的完整音频随机截取
+AUDIO_SOURCE_MODE = False
+SOURCE_AUDIO_FOLDER = "source"
+SOURCE_AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.m4a', '.ogg')
+CLIP_CACHE_FOLDER = "clip_cache"
+CLIP_CACHE_MAX_FILES = 200
+CLIP_CACHE_MAX_MB = 200
+CLIP_CACHE_READY_TARGET = 30  # 启动后后台先切出这么多片段备用
+CLIP_SECONDS = 10
+CLIP_WORKERS = 2
+FFMPEG_PATH = "ffmpeg"
+FFPROBE_PATH = "ffprobe"
+TIMER_WHEEL_SLOTS = 512
 
 # 全局变量
 current_quiz = {}
-recursion_guard = 0
-MAX_RECURSION_DEPTH = 10 
+onebot_client = None
+send_chains = {}  # 群号 -> 该群最后一条待发送消息的任务
 
-def send_group_message(group_id, message):
+def get_onebot_client():
+    """进程内共享的 OneBot HTTP 客户端，保持长连接复用"""
+    global onebot_client
+    if onebot_client is None or onebot_client.is_closed:
+        onebot_client = httpx.AsyncClient(
+            base_url=ONEBOT_HTTP_API_URL,
+            timeout=SEND_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=SEND_POOL_CONNECTIONS, max_keepalive_connections=SEND_POOL_CONNECTIONS),
+        )
+    return onebot_client
+
+async def post_group_message(group_id, message):
     """通过HTTP API向指定群聊发送消息"""
-    api_url = f"{ONEBOT_HTTP_API_URL}/send_group_msg"
-    payload = {"group_id": group_id, "message": message}
-    headers = {"Content-Type": "application/json"}
     try:
-        response = requests.post(api_url, data=json.dumps(payload), headers=headers, timeout=10)
+        response = await get_onebot_client().post("/send_group_msg", json={"group_id": group_id, "message": message})
         if response.json().get("status") == "ok":
             logging.info(f"成功向群 {group_id} 发送消息。")
         else:
             logging.error(f"向群 {group_id} 发送消息失败: {response.json().get('wording', '未知错误')}")
-    except requests.exceptions.RequestException as e:
+    except (httpx.HTTPError, ValueError) as e:
         logging.error(f"向群 {group_id} 发送消息时发生网络错误: {e}")
 
+async def send_after(previous, group_id, message):
+    if previous:
+        await asyncio.wait([previous])
+    await post_group_message(group_id, message)
+
+def send_group_message(group_id, message):
+    """排队发送群消息后立即返回：同一个群内按调用顺序送达，不同群之间并发发送，接收循环不会被慢响应卡住"""
+    task = asyncio.create_task(send_after(send_chains.get(group_id), group_id, message))
+    send_chains[group_id] = task
+    def release(done_task):
+        if send_chains.get(group_id) is done_task: del send_chains[group_id]
+    task.add_done_callback(release)
+
 def parse_lrc(lines):
     lyrics_by_timestamp = defaultdict(list)
     time_pattern = re.compile(r'(\[\d{2}:\d{2}\.\d{2,3}\])')
@@ -53,106 +117,727 @@ def parse_lrc(lines):
     else:
         return 'monolingual', [lyrics_by_timestamp[ts][0] for ts in sorted(lyrics_by_timestamp.keys()) if lyrics_by_timestamp[ts]]
 
-def set_quiz_state(group_id, starter_id, correct_song, correct_letter):
+def parse_lrc_timed(lines):
+    """提取每一句歌词及其毫秒时间戳，返回 [(毫秒, 歌词)]"""
+    time_pattern = re.compile(r'\[(\d{2}):(\d{2})\.(\d{2,3})\]')
+    timed_lyrics = []
+    for line in lines:
+        match = time_pattern.match(line)
+        if match:
+            minutes, seconds, fraction = match.groups()
+            lyric_text = line[match.end():].strip()
+            if lyric_text:
+                timed_lyrics.append((int(minutes) * 60000 + int(seconds) * 1000 + int(fraction.ljust(3, '0')), lyric_text))
+    return timed_lyrics
+
+def snippet_window(song_type, parsed_lyrics):
+    """计算可出题的 start_index 闭区间，返回 ((最小值, 最大值), None) 或 (None, 排除原因)"""
+    if song_type == 'bilingual':
+        if len(parsed_lyrics) < 6: return None, f"双语歌词仅 {len(parsed_lyrics)} 组，至少需要 6 组"
+        return (2, len(parsed_lyrics) - 4), None
+    if song_type == 'monolingual':
+        if len(parsed_lyrics) < 12: return None, f"单语歌词仅 {len(parsed_lyrics)} 行，至少需要 12 行"
+        return (4, len(parsed_lyrics) - 8), None
+    return None, "没有解析出带时间轴的歌词"
+
+class TimerWheel:
+    """哈希时间轮：所有群的答题截止时间共用一个驱动协程，插入和取消都是 O(1)"""
+    def __init__(self, tick=TIMER_TICK_SECONDS, slots=TIMER_WHEEL_SLOTS):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]  # 每个槽位: 句柄 -> [剩余圈数, 回调, 参数]
+        self.cursor = 0
+        self.timers = {}  # 句柄 -> 槽位下标
+        self.next_tick = None  # 下一次推进的事件循环时间，驱动协程启动后才有
+        self._handles = itertools.count(1)
+
+    def schedule(self, delay, callback, *args):
+        """登记一个定时回调，不早于 delay 秒触发，最多晚一个 tick；返回用于取消的句柄"""
+        if self.next_tick is None:
+            ticks = math.ceil(delay / self.tick) + 1
+        else:
+            # 从下一次推进的实际时刻算起，第 ticks 次推进是第一个不早于截止时间的
+            remaining = asyncio.get_running_loop().time() + delay - self.next_tick
+            ticks = max(1, math.ceil(remaining / self.tick) + 1)
+        slot = (self.cursor + ticks) % len(self.slots)
+        handle = next(self._handles)
+        self.slots[slot][handle] = [(ticks - 1) // len(self.slots), callback, args]
+        self.timers[handle] = slot
+        return handle
+
+    def cancel(self, handle):
+        slot = self.timers.pop(handle, None)
+        if slot is None: return False
+        del self.slots[slot][handle]
+        return True
+
+    async def run(self):
+        """驱动协程：每个 tick 推进一格，批量触发该槽位上到期的回调"""
+        loop = asyncio.get_running_loop()
+        self.next_tick = loop.time() + self.tick
+        while True:
+            await asyncio.sleep(max(0, self.next_tick - loop.time()))
+            self.cursor = (self.cursor + 1) % len(self.slots)
+            self.next_tick += self.tick
+            bucket, due = self.slots[self.cursor], []
+            for handle, timer in bucket.items():
+                if timer[0]: timer[0] -= 1
+                else: due.append(handle)
+            for handle in due:
+                _, callback, args = bucket.pop(handle)
+                del self.timers[handle]
+                try:
+                    callback(*args)
+                except Exception:
+                    logging.exception("定时回调执行失败。")
+
+timer_wheel = TimerWheel()
+
+def set_quiz_state(group_id, starter_id, correct_song, correct_letter, mode):
     """统一设置游戏状态和计时器"""
-    timer_task = asyncio.create_task(announce_answer_later(ANSWER_TIME_SECONDS, group_id))
+    timer_handle = timer_wheel.schedule(ANSWER_TIME_SECONDS, announce_answer, group_id)
     # 更新或创建游戏状态
     current_quiz[group_id] = {
         "correct_song": correct_song, 
         "correct_letter": correct_letter, 
         "starter_id": starter_id, 
         "active": True, 
-        "timer_task": timer_task
+        "timer_handle": timer_handle,
+        "mode": mode,
+        "started_at": time.monotonic()
     }
 
-def prepare_lyric_quiz(group_id, starter_id):
-    global recursion_guard
-    if recursion_guard >= MAX_RECURSION_DEPTH:
-        send_group_message(group_id, "题库好像出了点问题，请稍后再试吧。"); recursion_guard = 0; del current_quiz[group_id]; return
-    lrc_dir = os.path.join(os.path.dirname(__file__), LRC_FOLDER)
-    if not os.path.isdir(lrc_dir): send_group_message(group_id, f"错误：找不到 '{LRC_FOLDER}' 文件夹。"); del current_quiz[group_id]; return
-    song_list = [f[:-4] for f in os.listdir(lrc_dir) if f.endswith('.lrc')]
-    if len(song_list) < 4: send_group_message(group_id, "错误：歌词库歌曲不足4首。"); del current_quiz[group_id]; return
-    correct_song = random.choice(song_list)
-    try:
-        with open(os.path.join(lrc_dir, f"{correct_song}.lrc"), 'r', encoding='utf-8') as f: lines = f.readlines()
-    except Exception:
-        recursion_guard += 1; prepare_lyric_quiz(group_id, starter_id); return
-    song_type, parsed_lyrics = parse_lrc(lines)
-    lyric_snippet = ""
-    if song_type == 'bilingual':
-        if len(parsed_lyrics) < 6: recursion_guard += 1; prepare_lyric_quiz(group_id, starter_id); return
-        start_index = random.randint(2, len(parsed_lyrics) - 4)
-        lyric_snippet = "\n".join([line for pair in parsed_lyrics[start_index:start_index + 2] for line in pair])
-    elif song_type == 'monolingual':
-        if len(parsed_lyrics) < 12: recursion_guard += 1; prepare_lyric_quiz(group_id, starter_id); return
-        start_index = random.randint(4, len(parsed_lyrics) - 8)
-        lyric_snippet = "\n".join(parsed_lyrics[start_index:start_index + 4])
-    else: 
-        recursion_guard += 1; prepare_lyric_quiz(group_id, starter_id); return
+class ScoreStore:
+    """答题统计：内存聚合即时更新供排行榜查询，SQLite(WAL) 写入攒批后交给后台线程落盘"""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="score-db")  # 连接只在这一个线程里使用
+        self.pending = []
+        self.user_stats = defaultdict(dict)            # 群号 -> QQ号 -> [答对题数, 累计用时毫秒]
+        self.song_stats = defaultdict(lambda: [0, 0])  # 歌名 -> [出题次数, 被答对次数]
+        self._flush_event = asyncio.Event()
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS quiz_results (
+            id INTEGER PRIMARY KEY, group_id INTEGER NOT NULL, mode TEXT NOT NULL, song TEXT NOT NULL,
+            winner_id INTEGER, response_ms INTEGER, finished_at REAL NOT NULL)""")
+        self.conn.commit()
+        # 只在启动时聚合一次，之后全部增量更新
+        users = self.conn.execute("SELECT group_id, winner_id, COUNT(*), SUM(response_ms) FROM quiz_results WHERE winner_id IS NOT NULL GROUP BY group_id, winner_id").fetchall()
+        songs = self.conn.execute("SELECT song, COUNT(*), COUNT(winner_id) FROM quiz_results GROUP BY song").fetchall()
+        return users, songs
+
+    def _write(self, batch):
+        with self.conn:
+            self.conn.executemany("INSERT INTO quiz_results (group_id, mode, song, winner_id, response_ms, finished_at) VALUES (?, ?, ?, ?, ?, ?)", batch)
+
+    def record(self, group_id, mode, song, winner_id, response_ms):
+        """记录一道题的结果：内存聚合立即生效，数据库写入只进缓冲区"""
+        if winner_id is not None:
+            stats = self.user_stats[group_id].setdefault(winner_id, [0, 0])
+            stats[0] += 1; stats[1] += response_ms
+        song_stats = self.song_stats[song]
+        song_stats[0] += 1; song_stats[1] += winner_id is not None
+        self.pending.append((group_id, mode, song, winner_id, response_ms, time.time()))
+        if len(self.pending) >= SCORE_FLUSH_BATCH: self._flush_event.set()
+
+    async def flush(self):
+        if not self.pending or self.conn is None: return
+        batch, self.pending = self.pending, []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._write, batch)
+        except Exception as e:
+            logging.error(f"写入答题记录失败，将在下次重试: {e}")
+            self.pending[:0] = batch
+
+    def leaderboard(self, group_id, size=LEADERBOARD_SIZE):
+        """返回 [(QQ号, 答对题数, 平均用时秒数)]，按答对数降序、平均用时升序"""
+        top = heapq.nsmallest(size, self.user_stats.get(group_id, {}).items(), key=lambda item: (-item[1][0], item[1][1] / item[1][0]))
+        return [(user_id, correct, total_ms / correct / 1000) for user_id, (correct, total_ms) in top]
+
+    def hardest_songs(self, size=3, min_played=3):
+        """出题次数足够的歌里答对率最低的几首，返回 [(歌名, 答对率)]"""
+        played = ((song, solved / count) for song, (count, solved) in self.song_stats.items() if count >= min_played)
+        return heapq.nsmallest(size, played, key=lambda item: item[1])
+
+    async def run(self):
+        users, songs = await asyncio.get_running_loop().run_in_executor(self.executor, self._open)
+        for group_id, user_id, correct, total_ms in users:
+            stats = self.user_stats[group_id].setdefault(user_id, [0, 0])
+            stats[0] += correct; stats[1] += total_ms or 0
+        for song, count, solved in songs:
+            self.song_stats[song][0] += count; self.song_stats[song][1] += solved
+        logging.info(f"答题记录已加载：{sum(len(users) for users in self.user_stats.values())} 名玩家，{len(self.song_stats)} 首歌。")
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=SCORE_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+score_store = ScoreStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), SCORE_DB_FILE))
+
+BRACKET_PATTERN = re.compile(r'[(\[（【「『〈《].*?[)\]）】」』〉》]')
+
+def normalize_title(text):
+    """NFKC 统一全半角，折叠大小写与片假名，去掉标点、符号和空白"""
+    chars = []
+    for ch in unicodedata.normalize('NFKC', text).casefold():
+        if 'ァ' <= ch <= 'ヶ': ch = chr(ord(ch) - 0x60)
+        if unicodedata.category(ch)[0] not in 'PSZC': chars.append(ch)
+    return ''.join(chars)
+
+def title_bigrams(key):
+    return {key[i:i + 2] for i in range(len(key) - 1)} or {key}
+
+def bounded_edit_distance(a, b, limit):
+    """编辑距离，超过 limit 时提前返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit: return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit: return limit + 1
+        previous = current
+    return previous[-1]
+
+class TitleIndex:
+    """歌名模糊匹配索引：归一化精确表 + 二元组倒排预筛，只对少数候选计算编辑距离"""
+    def __init__(self, aliases_by_song):
+        self.exact = {}                 # 归一化写法 -> 歌名
+        self.grams = defaultdict(set)   # 二元组 -> 归一化写法
+        self.gram_counts = {}           # 归一化写法 -> 不同二元组的个数
+        for song, aliases in aliases_by_song.items():
+            for title in [song, BRACKET_PATTERN.sub('', song), *aliases]:
+                key = normalize_title(title)
+                if not key or key in self.exact: continue
+                self.exact[key] = song
+                grams = title_bigrams(key)
+                self.gram_counts[key] = len(grams)
+                for gram in grams: self.grams[gram].add(key)
+        self.max_len = max(map(len, self.exact), default=0)
+
+    @staticmethod
+    def max_distance(length):
+        return length // 4
+
+    def match(self, text):
+        """返回与 text 最接近的歌名；没有足够接近的，或有两首不同的歌同样接近时返回 None"""
+        # 长度远超任何歌名的闲聊直接放过，连归一化都不做
+        if len(text) > self.max_len * 2 + 8: return None
+        key = normalize_title(text)
+        if not key: return None
+        if key in self.exact: return self.exact[key]
+        limit = self.max_distance(len(key))
+        if not limit: return None
+        query_grams = title_bigrams(key)
+        shared = Counter(candidate for gram in query_grams for candidate in self.grams.get(gram, ()))
+        best, best_distance, ambiguous = None, limit + 1, False
+        for candidate, count in shared.items():
+            # q-gram 引理：每次编辑最多让一方的不同二元组少两个，共享数过少的候选不可能在 limit 以内
+            if count < max(len(query_grams), self.gram_counts[candidate]) - 2 * limit: continue
+            distance = bounded_edit_distance(key, candidate, min(limit, best_distance))
+            song = self.exact[candidate]
+            if distance < best_distance: best, best_distance, ambiguous = song, distance, False
+            elif distance == best_distance and distance <= limit and song != best: ambiguous = True
+        return None if ambiguous else best
+
+class LyricSearchIndex:
+    """歌词全文检索：按字符二元组建立倒排索引（适合中日文），分词结果序列化到磁盘，重启后按 mtime 复用"""
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.docs = {}                    # 歌名 -> {"mtime", "lines": [[毫秒, 原文, 归一化文本]], "grams": {二元组: [行号]}}
+        self.postings = defaultdict(set)  # 二元组 -> {(歌名, 行号)}
+        self.dirty = False
+        self._lock = threading.Lock()     # 刷新在后台线程，检索在事件循环
+        self.loaded = False
+
+    def _index_doc(self, song, doc):
+        for gram, line_indexes in doc["grams"].items():
+            self.postings[gram].update((song, i) for i in line_indexes)
+
+    def load(self):
+        """读取上次保存的索引，直接合并倒排表而不重新分词"""
+        self.loaded = True
+        if not os.path.isfile(self.index_path): return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f: docs = json.load(f)
+        except Exception as e:
+            logging.warning(f"读取歌词索引 {LYRIC_INDEX_FILE} 失败，将重新建立: {e}"); return
+        with self._lock:
+            self.docs = docs
+            for song, doc in docs.items(): self._index_doc(song, doc)
+
+    def save(self):
+        if not self.dirty: return
+        with self._lock:
+            payload = json.dumps(self.docs, ensure_ascii=False)
+            self.dirty = False
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f: f.write(payload)
+        os.replace(temp_path, self.index_path)
+
+    def update(self, song, mtime, timed_lyrics):
+        if self.docs.get(song, {}).get("mtime") == mtime: return
+        lines, grams = [], defaultdict(list)
+        for i, (ms, text) in enumerate(timed_lyrics):
+            key = normalize_title(text)
+            lines.append([ms, text, key])
+            if len(key) >= 2:
+                for gram in title_bigrams(key): grams[gram].append(i)
+        doc = {"mtime": mtime, "lines": lines, "grams": grams}
+        with self._lock:
+            self._unindex(song)
+            self.docs[song] = doc
+            self._index_doc(song, doc)
+            self.dirty = True
+
+    def remove(self, song):
+        with self._lock:
+            self._unindex(song)
+            self.dirty = True
+
+    def _unindex(self, song):
+        doc = self.docs.pop(song, None)
+        if not doc: return
+        for gram, line_indexes in doc["grams"].items():
+            posting = self.postings[gram]
+            posting.difference_update((song, i) for i in line_indexes)
+            if not posting: del self.postings[gram]
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """返回 [(歌名, 毫秒, 歌词)]，先按二元组求交集，再逐行确认确实包含查询文本"""
+        key = normalize_title(query)
+        if len(key) < 2: return []
+        with self._lock:
+            posting_lists = sorted((self.postings.get(gram, ()) for gram in title_bigrams(key)), key=len)
+            candidates = set(posting_lists[0])
+            for posting in posting_lists[1:]:
+                if not candidates: break
+                candidates &= posting
+            results = []
+            for song, i in candidates:
+                ms, text, line_key = self.docs[song]["lines"][i]
+                if key in line_key: results.append((song, ms, text))
+        return sorted(results)[:limit]
+
+# 某一时刻完整的歌曲目录。刷新线程整体替换 catalog.snapshot，出题方先取一次引用再读，
+# 不会读到一半旧、一半新的目录
+CatalogSnapshot = namedtuple("CatalogSnapshot", [
+    "has_lrc_dir", "lyrics", "lyric_songs", "eligible_songs", "excluded",
+    "has_slk_dir", "clips", "audio_songs", "has_source_dir", "sources", "source_songs", "title_index"])
 
-    options = [correct_song, *random.sample([s for s in song_list if s != correct_song], 3)]; random.shuffle(options)
-    full_message = f"🎶 看词猜鹿歌 🎶\n\n{lyric_snippet}\n\n请问这是哪首歌？\n"
+class SongCatalog:
+    """歌曲目录：启动时一次性加载 lrc/ 与 slk/，之后按文件 mtime 增量刷新，出题时只查内存。
+    下面的字段是刷新线程的工作副本，其他地方只读 snapshot"""
+    def __init__(self, base_dir):
+        self.lrc_dir = os.path.join(base_dir, LRC_FOLDER)
+        self.slk_dir = os.path.join(base_dir, SLK_FOLDER)
+        self.has_lrc_dir = False
+        self.has_slk_dir = False
+        self.lyrics = {}        # 歌名 -> {"mtime", "type", "lines", "window", "excluded_reason"}
+        self.lyric_songs = []   # 所有有歌词的歌名，用作选项
+        self.eligible_songs = []  # 歌词足够出题的歌名，抽题时直接 random.choice
+        self.excluded = {}      # 歌名 -> 被排除出题池的原因
+        self.clips = {}         # 歌名 -> [片段文件绝对路径]
+        self.audio_songs = []   # 所有有音频片段的歌名
+        self.source_dir = os.path.join(base_dir, SOURCE_AUDIO_FOLDER)
+        self.has_source_dir = False
+        self.sources = {}       # 歌名 -> 完整音频文件绝对路径
+        self.source_songs = []
+        self._slk_files = frozenset()
+        self.alias_file = os.path.join(base_dir, ALIAS_FILE)
+        self.aliases = {}       # 歌名 -> [别名]
+        self._alias_mtime = None
+        self.title_index = TitleIndex({})
+        self.search_index = LyricSearchIndex(os.path.join(base_dir, LYRIC_INDEX_FILE))
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        return CatalogSnapshot(self.has_lrc_dir, self.lyrics, self.lyric_songs, self.eligible_songs, self.excluded,
+                               self.has_slk_dir, self.clips, self.audio_songs, self.has_source_dir, self.sources, self.source_songs, self.title_index)
+
+    def refresh(self):
+        """对比文件 mtime，只重新解析新增或修改过的歌词；返回目录内容是否有变化"""
+        if not self.search_index.loaded: self.search_index.load()
+        lrc_changed = self._refresh_lyrics()
+        self.search_index.save()
+        slk_changed = self._refresh_clips()
+        source_changed = self._refresh_sources() if AUDIO_SOURCE_MODE else False
+        alias_changed = self._refresh_aliases()
+        changed = lrc_changed or slk_changed or source_changed or alias_changed
+        if changed:
+            songs = dict.fromkeys([*self.lyric_songs, *self.audio_songs, *self.source_songs])
+            self.title_index = TitleIndex({song: self.aliases.get(song, []) for song in songs})
+        # 目录存在与否可能单独变化，每次都整体发布一份新快照
+        self.snapshot = self._snapshot()
+        return changed
+
+    def _refresh_aliases(self):
+        mtime = os.path.getmtime(self.alias_file) if os.path.isfile(self.alias_file) else None
+        if mtime == self._alias_mtime: return False
+        self._alias_mtime, self.aliases = mtime, {}
+        if mtime is not None:
+            try:
+                with open(self.alias_file, 'r', encoding='utf-8') as f: self.aliases = json.load(f)
+            except Exception as e:
+                logging.warning(f"读取别名文件 {ALIAS_FILE} 失败: {e}")
+        return True
+
+    def _refresh_lyrics(self):
+        self.has_lrc_dir = os.path.isdir(self.lrc_dir)
+        if not self.has_lrc_dir:
+            changed = bool(self.lyrics)
+            self.lyrics, self.lyric_songs, self.eligible_songs, self.excluded = {}, [], [], {}
+            for song in list(self.search_index.docs): self.search_index.remove(song)
+            return changed
+        old_lyrics, new_lyrics, changed = self.lyrics, {}, False
+        with os.scandir(self.lrc_dir) as entries:
+            for entry in entries:
+                if not (entry.name.endswith('.lrc') and entry.is_file()): continue
+                song, mtime = entry.name[:-4], entry.stat().st_mtime
+                cached = old_lyrics.get(song)
+                if cached and cached["mtime"] == mtime:
+                    new_lyrics[song] = cached; continue
+                try:
+                    with open(entry.path, 'r', encoding='utf-8') as f: lines = f.readlines()
+                except Exception as e:
+                    logging.warning(f"读取歌词文件 {entry.name} 失败: {e}")
+                    new_lyrics[song] = {"mtime": mtime, "type": 'unknown', "lines": [], "window": None, "excluded_reason": f"读取失败: {e}"}
+                    changed = True; continue
+                song_type, parsed_lyrics = parse_lrc(lines)
+                window, reason = snippet_window(song_type, parsed_lyrics)
+                new_lyrics[song] = {"mtime": mtime, "type": song_type, "lines": parsed_lyrics, "window": window, "excluded_reason": reason}
+                self.search_index.update(song, mtime, parse_lrc_timed(lines))
+                changed = True
+        for song in [song for song in self.search_index.docs if song not in new_lyrics]:
+            self.search_index.remove(song)
+        if changed or new_lyrics.keys() != old_lyrics.keys():
+            # 整体替换引用，出题方永远看到一份完整的目录
+            self.lyrics, self.lyric_songs = new_lyrics, list(new_lyrics)
+            self.eligible_songs = [song for song, e in new_lyrics.items() if e["window"]]
+            self.excluded = {song: e["excluded_reason"] for song, e in new_lyrics.items() if not e["window"]}
+            return True
+        return False
+
+    def _refresh_clips(self):
+        self.has_slk_dir = os.path.isdir(self.slk_dir)
+        slk_files = frozenset(f for f in os.listdir(self.slk_dir) if f.endswith('.slk')) if self.has_slk_dir else frozenset()
+        if slk_files == self._slk_files: return False
+        clips = defaultdict(list)
+        for f in slk_files:
+            clips[f.split('_p')[0]].append(os.path.abspath(os.path.join(self.slk_dir, f)))
+        self.clips, self.audio_songs, self._slk_files = dict(clips), list(clips), slk_files
+        return True
+
+    def _refresh_sources(self):
+        self.has_source_dir = os.path.isdir(self.source_dir)
+        sources = {}
+        if self.has_source_dir:
+            for f in os.listdir(self.source_dir):
+                song, ext = os.path.splitext(f)
+                if ext.lower() in SOURCE_AUDIO_EXTENSIONS: sources[song] = os.path.abspath(os.path.join(self.source_dir, f))
+        if sources == self.sources: return False
+        self.sources, self.source_songs = sources, list(sources)
+        return True
+
+catalog = SongCatalog(os.path.dirname(os.path.abspath(__file__)))
+
+class ClipCache:
+    """从完整音频按需随机截取片段并编码为 silk，磁盘上按 LRU 保留有限数量的热片段"""
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()  # 片段路径 -> (歌名, 字节数)，最近使用的排在末尾
+        self.by_song = defaultdict(list)
+        self.songs = []               # 当前至少有一个可用片段的歌名
+        self.total_bytes = 0
+        self.durations = {}           # 完整音频路径 -> (mtime, 时长秒数)
+        self.jobs = asyncio.Queue()
+
+    def pick(self, song):
+        """取一个现成片段并标记为最近使用，同时让后台再切一个新片段补充多样性"""
+        path = random.choice(self.by_song[song])
+        self.entries.move_to_end(path)
+        self.jobs.put_nowait(None)
+        return path
+
+    def _add(self, path, song):
+        size = os.path.getsize(path)
+        self.entries[path] = (song, size)
+        self.total_bytes += size
+        if not self.by_song[song]: self.songs.append(song)
+        self.by_song[song].append(path)
+        while self.entries and (len(self.entries) > CLIP_CACHE_MAX_FILES or self.total_bytes > CLIP_CACHE_MAX_MB * 1024 * 1024):
+            self._evict()
+
+    def _evict(self):
+        path, (song, size) = self.entries.popitem(last=False)
+        self.total_bytes -= size
+        self.by_song[song].remove(path)
+        if not self.by_song[song]:
+            del self.by_song[song]; self.songs.remove(song)
+        try: os.remove(path)
+        except OSError as e: logging.warning(f"删除缓存片段 {path} 失败: {e}")
+
+    def _scan_existing(self):
+        """启动时把上次留下的片段按修改时间重新纳入 LRU"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for f in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, f)
+            if f.endswith('.tmp') or f.endswith('.pcm'):
+                os.remove(path); continue
+            if f.endswith('.slk') and '_o' in f: found.append((os.path.getmtime(path), path, f[:-4].rpartition('_o')[0]))
+        return sorted(found)
+
+    async def _probe_duration(self, source_path):
+        mtime = os.path.getmtime(source_path)
+        cached = self.durations.get(source_path)
+        if cached and cached[0] == mtime: return cached[1]
+        process = await asyncio.create_subprocess_exec(
+            FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nw=1:nk=1', source_path,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0: raise RuntimeError(f"ffprobe 失败: {stderr.decode('utf-8', 'ignore').strip()}")
+        duration = float(stdout.decode().strip())
+        self.durations[source_path] = (mtime, duration)
+        return duration
+
+    async def _cut_clip(self):
+        snapshot = catalog.snapshot
+        if not snapshot.source_songs: return
+        song = random.choice(snapshot.source_songs)
+        source_path = snapshot.sources[song]
+        duration = await self._probe_duration(source_path)
+        offset_ms = int(random.uniform(0, max(0.0, duration - CLIP_SECONDS)) * 1000)
+        final_path = os.path.join(self.cache_dir, f"{song}_o{offset_ms}.slk")
+        if final_path in self.entries: return
+        pcm_path, silk_path = final_path + '.pcm', final_path + '.tmp'
+        try:
+            process = await asyncio.create_subprocess_exec(
+                FFMPEG_PATH, '-v', 'error', '-y', '-ss', f"{offset_ms / 1000:.3f}", '-t', str(CLIP_SECONDS), '-i', source_path,
+                '-f', 's16le', '-ac', '1', '-ar', '24000', pcm_path,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, stderr = await process.communicate()
+            if process.returncode != 0: raise RuntimeError(f"ffmpeg 失败: {stderr.decode('utf-8', 'ignore').strip()}")
+            await asyncio.to_thread(pilk.encode, pcm_path, silk_path, pcm_rate=24000, tencent=True)
+            os.replace(silk_path, final_path)
+        finally:
+            for path in (pcm_path, silk_path):
+                if os.path.exists(path): os.remove(path)
+        self._add(os.path.abspath(final_path), song)
+        logging.info(f"已截取片段 {os.path.basename(final_path)}，缓存中共 {len(self.entries)} 个片段。")
+
+    async def _worker(self):
+        while True:
+            await self.jobs.get()
+            try:
+                await self._cut_clip()
+            except Exception as e:
+                logging.error(f"截取音频片段失败: {e}")
+            finally:
+                self.jobs.task_done()
+
+    async def run(self):
+        """后台启动：先接管已有缓存，再由若干工作协程补足片段，不阻塞机器人启动"""
+        for _, path, song in await asyncio.to_thread(self._scan_existing):
+            self._add(os.path.abspath(path), song)
+        logging.info(f"片段缓存已加载 {len(self.entries)} 个片段，共 {self.total_bytes / 1024 / 1024:.1f} MB。")
+        for _ in range(max(0, CLIP_CACHE_READY_TARGET - len(self.entries))): self.jobs.put_nowait(None)
+        await asyncio.gather(*(self._worker() for _ in range(CLIP_WORKERS)))
+
+clip_cache = ClipCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), CLIP_CACHE_FOLDER))
+
+async def refresh_catalog_periodically():
+    """后台定期增量刷新歌曲目录，磁盘扫描放到线程里，不阻塞消息处理"""
+    while True:
+        await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+        try:
+            if await asyncio.to_thread(catalog.refresh):
+                prefetcher.invalidate()
+                logging.info(f"歌曲目录已更新：歌词 {len(catalog.snapshot.lyric_songs)} 首，音频 {len(catalog.snapshot.audio_songs)} 首。")
+        except Exception as e:
+            logging.error(f"刷新歌曲目录失败: {e}")
+
+def render_options(header, correct_song, song_pool):
+    """生成四选一题面，返回 (题面文本, 正确选项字母)"""
+    options = [correct_song, *random.sample([s for s in song_pool if s != correct_song], 3)]; random.shuffle(options)
+    quiz_message = header
     option_letters, correct_answer_letter = ['A', 'B', 'C', 'D'], ''
     for i, option in enumerate(options):
-        full_message += f"{option_letters[i]}. {option}\n"
+        quiz_message += f"{option_letters[i]}. {option}\n"
         if option == correct_song: correct_answer_letter = option_letters[i]
-    full_message += f"\n请在2分钟内直接发送选项字母(A/B/C/D)或歌名作答哦~"
-    send_group_message(group_id, full_message)
-    set_quiz_state(group_id, starter_id, correct_song, correct_answer_letter)
-    recursion_guard = 0
-
-def prepare_audio_quiz(group_id, starter_id):
-    slk_dir = os.path.join(os.path.dirname(__file__), SLK_FOLDER)
-    if not os.path.isdir(slk_dir): send_group_message(group_id, f"错误：找不到 '{SLK_FOLDER}' 文件夹。"); del current_quiz[group_id]; return
-    slk_files = [f for f in os.listdir(slk_dir) if f.endswith('.slk')]
-    if not slk_files: send_group_message(group_id, f"错误：'{SLK_FOLDER}' 文件夹是空的。"); del current_quiz[group_id]; return
-    unique_songs = list(set([f.split('_p')[0] for f in slk_files]))
-    if len(unique_songs) < 4: send_group_message(group_id, "错误：音频库歌曲不足4首。"); del current_quiz[group_id]; return
+    quiz_message += f"\n请在2分钟内直接发送选项字母(A/B/C/D)或歌名作答哦~"
+    return quiz_message, correct_answer_letter
+
+def build_lyric_quiz():
+    """生成一道看词猜鹿歌，返回 (题目, 错误提示)"""
+    snapshot = catalog.snapshot
+    if not snapshot.has_lrc_dir: return None, f"错误：找不到 '{LRC_FOLDER}' 文件夹。"
+    song_list = snapshot.lyric_songs
+    if len(song_list) < 4: return None, "错误：歌词库歌曲不足4首。"
+    if not snapshot.eligible_songs: return None, "题库好像出了点问题，请稍后再试吧。"
+    # 出题池里的歌都预先算好了合法区间，一次抽取必定成功
+    correct_song = random.choice(snapshot.eligible_songs)
+    entry = snapshot.lyrics[correct_song]
+    parsed_lyrics = entry["lines"]
+    start_index = random.randint(*entry["window"])
+    if entry["type"] == 'bilingual':
+        lyric_snippet = "\n".join([line for pair in parsed_lyrics[start_index:start_index + 2] for line in pair])
+    else:
+        lyric_snippet = "\n".join(parsed_lyrics[start_index:start_index + 4])
+    full_message, correct_answer_letter = render_options(f"🎶 看词猜鹿歌 🎶\n\n{lyric_snippet}\n\n请问这是哪首歌？\n", correct_song, song_list)
+    return {"messages": [full_message], "correct_song": correct_song, "correct_letter": correct_answer_letter}, None
+
+def build_audio_quiz():
+    """生成一道听音猜鹿歌，返回 (题目, 错误提示)"""
+    if AUDIO_SOURCE_MODE: return build_source_audio_quiz()
+    snapshot = catalog.snapshot
+    if not snapshot.has_slk_dir: return None, f"错误：找不到 '{SLK_FOLDER}' 文件夹。"
+    if not snapshot.clips: return None, f"错误：'{SLK_FOLDER}' 文件夹是空的。"
+    unique_songs = snapshot.audio_songs
+    if len(unique_songs) < 4: return None, "错误：音频库歌曲不足4首。"
     correct_song = random.choice(unique_songs)
-    song_parts = [f for f in slk_files if f.startswith(correct_song + '_p')]
-    chosen_part_filename = random.choice(song_parts)
-    absolute_path = os.path.abspath(os.path.join(slk_dir, chosen_part_filename))
+    absolute_path = random.choice(snapshot.clips[correct_song])
     audio_cq_code = f"[CQ:record,file=file:///{absolute_path}]"
-    send_group_message(group_id, audio_cq_code)
-    
-    async def send_options_later():
-        await asyncio.sleep(1) 
-        options = [correct_song, *random.sample([s for s in unique_songs if s != correct_song], 3)]; random.shuffle(options)
-        quiz_message = f"🎶 听音猜鹿歌 🎶\n\n请问这是哪首歌？\n"
-        option_letters, correct_answer_letter = ['A', 'B', 'C', 'D'], ''
-        for i, option in enumerate(options):
-            quiz_message += f"{option_letters[i]}. {option}\n"
-            if option == correct_song: correct_answer_letter = option_letters[i]
-        quiz_message += f"\n请在2分钟内直接发送选项字母(A/B/C/D)或歌名作答哦~"
-        send_group_message(group_id, quiz_message)
-        set_quiz_state(group_id, starter_id, correct_song, correct_answer_letter)
-    asyncio.create_task(send_options_later())
-
-async def announce_answer_later(delay, group_id):
-    try:
-        await asyncio.sleep(delay)
-        if current_quiz.get(group_id, {}).get("active"):
-            quiz_data = current_quiz[group_id]
-            starter_id, correct_song, correct_letter = quiz_data.get("starter_id"), quiz_data.get("correct_song"), quiz_data.get("correct_letter")
-            at_string = f"[CQ:at,qq={starter_id}] " if starter_id else ""
-            message = f"{at_string}时间到！正确答案是 {correct_letter}. {correct_song}！"
-            send_group_message(group_id, message)
-            if group_id in current_quiz: del current_quiz[group_id]
-    except asyncio.CancelledError:
-        logging.info(f"群 {group_id} 的计时器被成功取消。")
+    quiz_message, correct_answer_letter = render_options(f"🎶 听音猜鹿歌 🎶\n\n请问这是哪首歌？\n", correct_song, unique_songs)
+    return {"messages": [audio_cq_code, quiz_message], "correct_song": correct_song, "correct_letter": correct_answer_letter, "clip_path": absolute_path}, None
+
+def build_source_audio_quiz():
+    """完整音频截取模式下，从片段缓存里出题"""
+    snapshot = catalog.snapshot
+    if not snapshot.has_source_dir: return None, f"错误：找不到 '{SOURCE_AUDIO_FOLDER}' 文件夹。"
+    if len(snapshot.source_songs) < 4: return None, "错误：完整音频库歌曲不足4首。"
+    ready_songs = [song for song in clip_cache.songs if song in snapshot.sources]
+    if not ready_songs: return None, "音频片段还在准备中，请稍后再试吧。"
+    correct_song = random.choice(ready_songs)
+    absolute_path = clip_cache.pick(correct_song)
+    audio_cq_code = f"[CQ:record,file=file:///{absolute_path}]"
+    quiz_message, correct_answer_letter = render_options(f"🎶 听音猜鹿歌 🎶\n\n请问这是哪首歌？\n", correct_song, snapshot.source_songs)
+    return {"messages": [audio_cq_code, quiz_message], "correct_song": correct_song, "correct_letter": correct_answer_letter, "clip_path": absolute_path}, None
+
+class QuizPrefetcher:
+    """每种玩法预先渲染好几道题，触发时直接取出发送，后台协程负责补货"""
+    def __init__(self, builders, depth=QUIZ_PREFETCH_DEPTH):
+        self.builders = builders
+        self.depth = depth
+        self.buffers = {mode: deque() for mode in builders}
+        self.hits = 0
+        self.misses = 0
+        self._wakeup = asyncio.Event()
+
+    def take(self, mode):
+        """取出一道题，返回 (题目, 错误提示)；缓冲为空时现场生成并记一次未命中"""
+        buffer = self.buffers[mode]
+        self._wakeup.set()
+        if buffer:
+            self.hits += 1
+            return buffer.popleft(), None
+        self.misses += 1
+        return self._build(mode)
+
+    def _build(self, mode):
+        """生成一道题；出题函数抛出异常时记录日志并当作暂时出不了题，不让后台补货协程退出"""
+        try:
+            return self.builders[mode]()
+        except Exception:
+            logging.exception(f"生成 {mode} 题目失败。")
+            return None, "出题时遇到了问题，请稍后再试吧。"
+
+    def invalidate(self):
+        """题库变化后丢弃旧题，避免发出已删除的歌或片段"""
+        for buffer in self.buffers.values(): buffer.clear()
+        self._wakeup.set()
+
+    def stats(self):
+        total = self.hits + self.misses
+        hit_rate = f"{self.hits / total:.0%}" if total else "暂无数据"
+        depths = "，".join(f"{mode} {len(buffer)}/{self.depth}" for mode, buffer in self.buffers.items())
+        return f"预取缓冲：{depths}；命中率 {hit_rate}（{self.hits}/{total}）"
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            for mode, buffer in self.buffers.items():
+                while len(buffer) < self.depth:
+                    quiz, error = self._build(mode)
+                    if error: break
+                    buffer.append(quiz)
+            # 补满后等下一次取题或题库变化；题库暂时不足时隔一段时间再试
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=CATALOG_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+prefetcher = QuizPrefetcher({LYRIC_TRIGGER_COMMAND: build_lyric_quiz, AUDIO_TRIGGER_COMMAND: build_audio_quiz})
+
+def start_quiz(group_id, starter_id, mode):
+    quiz, error = prefetcher.take(mode)
+    if error:
+        send_group_message(group_id, error); del current_quiz[group_id]; return
+    # 同群消息按顺序送达，音频一定先于选项出现，不再需要额外等待
+    for message in quiz["messages"]:
+        send_group_message(group_id, message)
+    set_quiz_state(group_id, starter_id, quiz["correct_song"], quiz["correct_letter"], mode)
+
+def send_catalog_report(group_id):
+    """列出出题池概况以及被排除的歌曲和原因"""
+    snapshot = catalog.snapshot
+    message = f"📋 鹿歌题库报告\n歌词 {len(snapshot.lyric_songs)} 首，可出题 {len(snapshot.eligible_songs)} 首；音频 {len(snapshot.audio_songs)} 首。"
+    if snapshot.excluded:
+        message += f"\n\n以下 {len(snapshot.excluded)} 首歌词未进入看词出题池：\n"
+        message += "\n".join(f"- {song}：{reason}" for song, reason in sorted(snapshot.excluded.items()))
+    message += f"\n\n{prefetcher.stats()}"
+    send_group_message(group_id, message)
+
+def announce_answer(group_id):
+    if current_quiz.get(group_id, {}).get("active"):
+        quiz_data = current_quiz[group_id]
+        starter_id, correct_song, correct_letter = quiz_data.get("starter_id"), quiz_data.get("correct_song"), quiz_data.get("correct_letter")
+        at_string = f"[CQ:at,qq={starter_id}] " if starter_id else ""
+        message = f"{at_string}时间到！正确答案是 {correct_letter}. {correct_song}！"
+        send_group_message(group_id, message)
+        score_store.record(group_id, quiz_data.get("mode"), correct_song, None, None)
+        if group_id in current_quiz: del current_quiz[group_id]
+
+def send_lyric_search(group_id, query):
+    if not query:
+        send_group_message(group_id, f"请在“{SEARCH_COMMAND}”后面加上要搜索的歌词，例如：{SEARCH_COMMAND} 你好"); return
+    results = catalog.search_index.search(query)
+    if not results:
+        send_group_message(group_id, f"没有找到包含“{query}”的鹿歌歌词。"); return
+    message = f"🔍 包含“{query}”的歌词：\n"
+    message += "\n".join(f"- {song}（{ms} ms）：{text}" for song, ms, text in results)
+    send_group_message(group_id, message)
+
+def send_leaderboard(group_id):
+    ranking = score_store.leaderboard(group_id)
+    if not ranking:
+        send_group_message(group_id, "本群还没有人答对过鹿歌哦，快来发送“看词猜鹿歌”或“听音猜鹿歌”吧~"); return
+    message = "🏆 本群鹿歌排行 🏆\n"
+    message += "\n".join(f"{rank}. {user_id}：答对 {correct} 题，平均 {avg_seconds:.1f} 秒" for rank, (user_id, correct, avg_seconds) in enumerate(ranking, 1))
+    if (hardest := score_store.hardest_songs()):
+        message += "\n\n最难猜的鹿歌：\n" + "\n".join(f"- {song}（答对率 {rate:.0%}）" for song, rate in hardest)
+    send_group_message(group_id, message)
 
 def handle_answer(group_id, message_text, user_id):
     if not current_quiz.get(group_id, {}).get("active"): return
     quiz_data = current_quiz[group_id]
-    # 增加一个检查，如果题目数据还没填充完整（主要针对听音猜歌的延迟），则忽略回答
+    # 增加一个检查，如果题目数据还没填充完整，则忽略回答
     if "correct_song" not in quiz_data: return
     answer = message_text.strip().upper()
     correct_song, correct_letter = quiz_data.get("correct_song"), quiz_data.get("correct_letter")
-    if answer == correct_letter or answer == correct_song.upper():
-        if (timer_task := quiz_data.get("timer_task")): timer_task.cancel()
+    if answer == correct_letter or answer == correct_song.upper() or catalog.snapshot.title_index.match(message_text) == correct_song:
+        if timer_wheel.cancel(quiz_data.get("timer_handle")): logging.info(f"群 {group_id} 的计时器被成功取消。")
         message = f"[CQ:at,qq={user_id}] 恭喜你，答对啦！🎉\n正确答案就是 {correct_song}！"
         send_group_message(group_id, message)
+        response_ms = int((time.monotonic() - quiz_data["started_at"]) * 1000)
+        score_store.record(group_id, quiz_data.get("mode"), correct_song, user_id, response_ms)
         if group_id in current_quiz: del current_quiz[group_id]
     elif answer in ['A', 'B', 'C', 'D']:
         send_group_message(group_id, f"[CQ:at,qq={user_id}] 回答错误，再想想看哦~")
@@ -171,8 +856,15 @@ async def handle_websocket_connection():
                             
                             is_game_active = current_quiz.get(group_id, {}).get("active")
                             
+                            if raw_message == REPORT_COMMAND:
+                                send_catalog_report(group_id)
+                            elif raw_message == LEADERBOARD_COMMAND:
+                                send_leaderboard(group_id)
+                            elif raw_message.startswith(SEARCH_COMMAND):
+                                send_lyric_search(group_id, raw_message[len(SEARCH_COMMAND):].strip())
+
                             # 统一处理游戏开始指令
-                            if raw_message in [LYRIC_TRIGGER_COMMAND, AUDIO_TRIGGER_COMMAND]:
+                            elif raw_message in [LYRIC_TRIGGER_COMMAND, AUDIO_TRIGGER_COMMAND]:
                                 if is_game_active:
                                     send_group_message(group_id, "上一题还没结束哦，请先回答吧~")
                                 else:
@@ -180,10 +872,7 @@ async def handle_websocket_connection():
                                     current_quiz[group_id] = {"active": True, "starter_id": user_id} 
                                     logging.info(f"群 {group_id} 已锁定，准备开始游戏...")
                                     
-                                    if raw_message == LYRIC_TRIGGER_COMMAND:
-                                        prepare_lyric_quiz(group_id, user_id)
-                                    elif raw_message == AUDIO_TRIGGER_COMMAND:
-                                        prepare_audio_quiz(group_id, user_id)
+                                    start_quiz(group_id, user_id, raw_message)
                             
                             # 处理回答
                             elif is_game_active:
@@ -194,12 +883,30 @@ async def handle_websocket_connection():
             logging.error(f"无法连接或处理 WebSocket: {e}。将在 10 秒后重试...")
             await asyncio.sleep(10)
 
+async def main():
+    asyncio.create_task(refresh_catalog_periodically())
+    asyncio.create_task(timer_wheel.run())
+    asyncio.create_task(prefetcher.run())
+    asyncio.create_task(score_store.run())
+    if AUDIO_SOURCE_MODE:
+        if pilk is None:
+            logging.error("完整音频截取模式需要安装 pilk（pip install pilk），听音猜鹿歌暂不可用。")
+        else:
+            asyncio.create_task(clip_cache.run())
+    try:
+        await handle_websocket_connection()
+    finally:
+        await score_store.flush()
+        if onebot_client: await onebot_client.aclose()
+
 if __name__ == "__main__":
     logging.info("终极防并发猜歌机器人启动中...")
-    for folder in [LRC_FOLDER, SLK_FOLDER]:
+    for folder in [LRC_FOLDER, SLK_FOLDER, *([SOURCE_AUDIO_FOLDER] if AUDIO_SOURCE_MODE else [])]:
         if not os.path.isdir(folder):
             os.makedirs(folder); logging.info(f"已自动创建 '{folder}' 文件夹。")
+    catalog.refresh()
+    logging.info(f"歌曲目录加载完成：歌词 {len(catalog.snapshot.lyric_songs)} 首，音频 {len(catalog.snapshot.audio_songs)} 首。")
     try:
-        asyncio.run(handle_websocket_connection())
+        asyncio.run(main())
     except KeyboardInterrupt:
         logging.info("机器人已手动停止。")
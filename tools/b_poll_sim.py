@@ -0,0 +1,133 @@
+"""b.py 自适应轮询模拟：用假时钟回放若干天的开播和动态，比较不同空闲间隔下的请求量和检测延迟。
+
+直接调用 b.py 的 AdaptiveInterval、live_is_hot、dynamic_is_active 和 dynamic_poll_spacing，只把其中的 time 换成假时钟，
+不发任何请求。检测延迟按 record_detection_latency 的口径（检测时刻 − 开播/发布时刻）计算，用 b.py 的 TimingStats 输出。
+各配置回放同一份随机事件，结果可以直接对比；第一天用来积累开播时刻，不计入统计。
+
+事件模型：
+  直播  每个目标每天以 --stream-prob 的概率开播一次，多数在各自的习惯时刻附近（正态分布，标准差 --start-jitter 分钟），
+        其中 --off-schedule 的比例在一天中的随机时刻开播（“热点外”单独统计），时长 1~3 小时
+  动态  每个目标每天平均 --dynamics 条，发布在 8 点到 24 点之间；每条之后有 --burst-prob 的概率在 10 分钟内再发一条
+
+配置写成“直播空闲间隔/动态空闲间隔”，请求量的百分比相对第一个配置（默认是固定 3 秒轮询）。
+
+用法：python tools/b_poll_sim.py [--targets 3] [--days 30] [--configs 3/3,10/15,30/120] [--seed 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import b  # noqa: E402
+
+DAY = 86400
+
+
+def make_events(rng, targets, days, args):
+    """返回 {uid: [(开播时刻, 下播时刻, 是否热点外)]} 和 {uid: [发布时刻]}，时刻相对第 0 天零点"""
+    streams, dynamics = {}, {}
+    for uid in targets:
+        habit = rng.randint(19 * 60, 22 * 60)  # 习惯开播时刻（当天第几分钟）
+        streams[uid], dynamics[uid] = [], []
+        for day in range(days):
+            start_of_day = day * DAY
+            if rng.random() < args.stream_prob:
+                off = rng.random() < args.off_schedule
+                start = start_of_day + (rng.uniform(0, DAY) if off else habit * 60 + rng.gauss(0, args.start_jitter * 60))
+                streams[uid].append((start, start + rng.uniform(3600, 3 * 3600), off))
+            t = start_of_day + 8 * 3600
+            while (t := t + rng.expovariate(args.dynamics / (16 * 3600))) < start_of_day + DAY:
+                dynamics[uid].append(t)
+                if rng.random() < args.burst_prob: dynamics[uid].append(t + rng.uniform(60, 600))
+        dynamics[uid].sort()
+    return streams, dynamics
+
+
+def simulate(streams, dynamics, days, live_idle, dynamic_idle, epoch):
+    """回放一遍，返回 (直播请求数, 动态请求数, {统计名: TimingStats})，都只计第一天之后的部分"""
+    clock = types.SimpleNamespace(now=epoch)
+    b.time = types.SimpleNamespace(time=lambda: clock.now, monotonic=lambda: clock.now,
+                                   localtime=lambda t=None: time.localtime(clock.now if t is None else t))
+    b.TARGETS = [{"uid": uid, "live": True, "groups": []} for uid in streams]
+    b.target_states.clear()
+    stats = {name: b.TimingStats(text, report_every=10 ** 9) for name, text in
+             (("live", "开播检测延迟"), ("live_off", "开播检测延迟（热点外）"), ("dynamic", "动态检测延迟"))}
+    warmup, end = epoch + DAY, epoch + days * DAY
+    live = b.AdaptiveInterval(b.LIVE_CHECK_INTERVAL_SECONDS, live_idle)
+    schedules = {uid: b.AdaptiveInterval(b.DYNAMIC_CHECK_INTERVAL_SECONDS, dynamic_idle) for uid in streams}
+    spacing = b.dynamic_poll_spacing()
+    next_live = epoch
+    due = {uid: epoch + i * spacing for i, uid in enumerate(streams)}
+    checked_upto = dict.fromkeys(streams, epoch)
+    last_dynamic_started = epoch - spacing
+    live_requests = dynamic_requests = 0
+
+    while True:
+        uid = min(due, key=due.get)
+        next_dynamic = max(due[uid], last_dynamic_started + spacing)
+        clock.now = min(next_live, next_dynamic)
+        if clock.now >= end: break
+        counted = clock.now >= warmup
+        if clock.now == next_live:
+            live_requests += counted
+            for target_uid, target_streams in streams.items():
+                state = b.get_target_state(target_uid)
+                current = next(((start, off) for start, stop, off in target_streams if epoch + start <= clock.now < epoch + stop), None)
+                status = 1 if current else 0
+                if status == state['last_live_status']: continue
+                if status == 1 and state['last_live_status'] != -1:
+                    start, off = current
+                    if counted: stats["live_off" if off else "live"].record(clock.now - epoch - start)
+                    started = time.localtime(epoch + start)
+                    state['live_start_minutes'] = (state['live_start_minutes'] + [started.tm_hour * 60 + started.tm_min])[-b.LIVE_START_HISTORY_SIZE:]
+                state['last_live_status'] = status
+            next_live = clock.now + live.next_delay(b.live_is_hot())
+        else:
+            dynamic_requests += counted
+            last_dynamic_started = clock.now
+            state = b.get_target_state(uid)
+            for published in (p for p in dynamics[uid] if checked_upto[uid] < epoch + p <= clock.now):
+                if counted: stats["dynamic"].record(clock.now - epoch - published)
+                state['last_dynamic_at'] = max(state['last_dynamic_at'], epoch + published)
+            checked_upto[uid] = clock.now
+            target = next(t for t in b.TARGETS if t["uid"] == uid)
+            due[uid] = clock.now + schedules[uid].next_delay(b.dynamic_is_active(target))
+    return live_requests, dynamic_requests, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", type=int, default=3)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--configs", default="3/3,10/15,30/120", help="直播空闲间隔/动态空闲间隔（秒），逗号分隔")
+    parser.add_argument("--stream-prob", type=float, default=0.8)
+    parser.add_argument("--off-schedule", type=float, default=0.15)
+    parser.add_argument("--start-jitter", type=float, default=10)
+    parser.add_argument("--dynamics", type=float, default=3, help="每个目标每天的平均动态数（不含连发）")
+    parser.add_argument("--burst-prob", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    streams, dynamics = make_events(rng, range(1, args.targets + 1), args.days, args)
+    epoch = time.mktime((2026, 1, 5, 0, 0, 0, 0, 0, -1))  # 本地时区的某天零点，热点时段按本地时刻计算
+    print(f"{args.targets} 个目标，回放 {args.days} 天（统计后 {args.days - 1} 天）：开播 {sum(map(len, streams.values()))} 次，"
+          f"动态 {sum(map(len, dynamics.values()))} 条；最短间隔 直播 {b.LIVE_CHECK_INTERVAL_SECONDS} 秒 / 动态 {b.DYNAMIC_CHECK_INTERVAL_SECONDS} 秒，"
+          f"动态请求相隔至少 {b.dynamic_poll_spacing():g} 秒，热点时段 ±{b.LIVE_HOT_WINDOW_MINUTES} 分钟，动态活跃期 {b.DYNAMIC_ACTIVE_WINDOW_MINUTES} 分钟")
+    baseline = None
+    for config in args.configs.split(","):
+        live_idle, dynamic_idle = map(float, config.split("/"))
+        live_requests, dynamic_requests, stats = simulate(streams, dynamics, args.days, live_idle, dynamic_idle, epoch)
+        total = live_requests + dynamic_requests
+        baseline = baseline or total
+        days = args.days - 1
+        print(f"\n[直播空闲 {live_idle:g} 秒 / 动态空闲 {dynamic_idle:g} 秒]")
+        print(f"  请求量：直播 {live_requests / days:.0f} 次/天，动态 {dynamic_requests / days:.0f} 次/天，合计为第一个配置的 {total / baseline * 100:.0f}%")
+        for timing in stats.values(): timing.report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""cai.py 发送路径压测：OneBot 回执变慢时，事件到回复的延迟应保持平稳。
+
+本地起一个 WebSocket 事件桩和一个 OneBot HTTP 桩，按固定速率推送“鹿歌排行”群消息事件
+（每个事件一个群，互不排队），记录从事件发出到对应回复请求到达 HTTP 桩的时间。
+依次给 HTTP 桩加上不同的回执延迟，比较各轮的延迟分布。
+
+速率 × 回执延迟不超过连接池上限（SEND_POOL_CONNECTIONS）时，延迟应与无延迟时基本一致；
+超过后请求要排队等空闲连接，延迟随之上升，结果行会标出“超出连接池”。
+
+用法：python tools/cai_send_load.py [--events 200] [--rate 20] [--delays 0,0.2,0.5,0.9]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cai  # noqa: E402
+from onebot_stub import OneBotHttpStub, summarize  # noqa: E402
+
+
+async def run_round(stub, events, rate):
+    sent = {}
+
+    async def emit(websocket, *_):
+        for i in range(events):
+            group_id = 100000 + i
+            sent[group_id] = time.monotonic()
+            await websocket.send(json.dumps({"post_type": "message", "message_type": "group", "group_id": group_id,
+                                             "user_id": 1, "raw_message": cai.LEADERBOARD_COMMAND}))
+            await asyncio.sleep(1 / rate)
+        await websocket.wait_closed()
+
+    async with websockets.serve(emit, "127.0.0.1", 0) as server:
+        cai.ONEBOT_WS_URL = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        bot = asyncio.create_task(cai.handle_websocket_connection())
+        await stub.wait_for(events)
+        bot.cancel()
+        await asyncio.gather(bot, return_exceptions=True)
+    latencies = [arrived - sent[payload["group_id"]] for arrived, _, payload in stub.requests if payload.get("group_id") in sent]
+    # 等已发出的请求收完回执，再关闭客户端，下一轮从新的连接池开始
+    await asyncio.sleep(stub.delay)
+    if cai.onebot_client: await cai.onebot_client.aclose()
+    cai.onebot_client = None
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=20, help="每秒推送的事件数")
+    parser.add_argument("--delays", default="0,0.2,0.5,0.9", help="OneBot 桩的回执延迟（秒），逗号分隔")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stub = OneBotHttpStub()
+    cai.ONEBOT_HTTP_API_URL = await stub.start()
+    print(f"{args.events} 个事件，每秒 {args.rate:g} 个，连接池上限 {cai.SEND_POOL_CONNECTIONS}")
+    try:
+        for delay in (float(d) for d in args.delays.split(",")):
+            stub.reset(delay)
+            latencies = await run_round(stub, args.events, args.rate)
+            saturated = "（超出连接池）" if args.rate * delay > cai.SEND_POOL_CONNECTIONS else ""
+            print(f"回执延迟 {delay * 1000:6.0f} ms：事件→回复 {summarize(latencies)}，收到 {len(latencies)}/{args.events}，连接 {stub.connections} 条{saturated}")
+    finally:
+        await stub.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+"""cai.py 计时器基准：一万道同时进行的题目，时间轮 vs 每题一个 asyncio.sleep 任务。
+
+两种方式各自登记 --quizzes 个截止时间（在 --min-delay 到 --max-delay 秒之间随机），
+取消其中 --cancel-ratio 的比例（模拟提前答对），其余等待触发。分别统计：
+登记耗时、登记后新增的内存（tracemalloc）、取消耗时、整轮的 CPU 时间，以及触发时刻比预定晚多少。
+时间轮的触发精度是一个 tick（TIMER_TICK_SECONDS），延迟上限也以此为准。
+
+用法：python tools/cai_timer_bench.py [--quizzes 10000] [--min-delay 2] [--max-delay 4] [--cancel-ratio 0.5]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cai  # noqa: E402
+from onebot_stub import summarize  # noqa: E402
+
+
+async def bench_tasks(delays, cancel_count):
+    lateness = []
+    loop = asyncio.get_running_loop()
+
+    async def deadline(due):
+        await asyncio.sleep(due - loop.time())
+        lateness.append(loop.time() - due)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    started, cpu_started = time.perf_counter(), time.process_time()
+    tasks = [asyncio.create_task(deadline(loop.time() + delay)) for delay in delays]
+    schedule_seconds = time.perf_counter() - started
+    await asyncio.sleep(0)  # 让任务真正进入 sleep，计入各自的协程帧和定时句柄
+    memory = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for task in tasks[:cancel_count]: task.cancel()
+    cancel_seconds = time.perf_counter() - started
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return schedule_seconds, memory, cancel_seconds, time.process_time() - cpu_started, lateness
+
+
+async def bench_wheel(delays, cancel_count):
+    lateness = []
+    loop = asyncio.get_running_loop()
+    wheel = cai.TimerWheel()
+    driver = asyncio.create_task(wheel.run())
+    await asyncio.sleep(0)
+
+    def fire(due):
+        lateness.append(loop.time() - due)
+
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    started, cpu_started = time.perf_counter(), time.process_time()
+    handles = [wheel.schedule(delay, fire, loop.time() + delay) for delay in delays]
+    schedule_seconds = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for handle in handles[:cancel_count]: wheel.cancel(handle)
+    cancel_seconds = time.perf_counter() - started
+    while wheel.timers: await asyncio.sleep(wheel.tick)
+    cpu_seconds = time.process_time() - cpu_started
+    driver.cancel()
+    await asyncio.gather(driver, return_exceptions=True)
+    return schedule_seconds, memory, cancel_seconds, cpu_seconds, lateness
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quizzes", type=int, default=10000)
+    parser.add_argument("--min-delay", type=float, default=2)
+    parser.add_argument("--max-delay", type=float, default=4)
+    parser.add_argument("--cancel-ratio", type=float, default=0.5)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    delays = [random.uniform(args.min_delay, args.max_delay) for _ in range(args.quizzes)]
+    cancel_count = int(args.quizzes * args.cancel_ratio)
+    print(f"{args.quizzes} 道题，截止时间 {args.min_delay:g}~{args.max_delay:g} 秒，提前取消 {cancel_count} 道；时间轮 tick {cai.TIMER_TICK_SECONDS} 秒")
+    for name, bench in (("每题一个任务", bench_tasks), ("时间轮", bench_wheel)):
+        schedule_seconds, memory, cancel_seconds, cpu_seconds, lateness = await bench(delays, cancel_count)
+        print(f"\n[{name}]")
+        print(f"  登记耗时 {schedule_seconds * 1000:.1f} ms，新增内存 {memory / 1024:.0f} KiB（每题 {memory / args.quizzes:.0f} B）")
+        print(f"  取消耗时 {cancel_seconds * 1000:.1f} ms，整轮 CPU 时间 {cpu_seconds * 1000:.0f} ms")
+        print(f"  触发晚于预定：{summarize(lateness)}（{len(lateness)} 次触发）")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""本地 OneBot HTTP API 桩，供 tools/ 下的压测和基准脚本使用。
+
+只实现脚本需要的部分：接受任意 POST（如 /send_group_msg），记录到达时间和请求体，
+按设定的延迟返回 {"status": "ok"}；支持 HTTP/1.1 keep-alive，可以统计客户端实际建立了多少条连接。
+"""
+import asyncio
+import json
+import time
+
+
+class OneBotHttpStub:
+    def __init__(self, delay=0.0, host="127.0.0.1", port=0):
+        self.delay = delay
+        self.host = host
+        self.port = port
+        self.requests = []  # [(到达时间 monotonic, 路径, 请求体)]
+        self.connections = 0
+        self.server = None
+        self._arrived = asyncio.Event()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return f"http://{self.host}:{self.port}"
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def reset(self, delay=None):
+        self.requests.clear()
+        self.connections = 0
+        if delay is not None: self.delay = delay
+
+    async def wait_for(self, count, timeout=60):
+        """等到累计收到 count 个请求，超时则直接返回"""
+        deadline = time.monotonic() + timeout
+        while len(self.requests) < count and time.monotonic() < deadline:
+            self._arrived.clear()
+            try: await asyncio.wait_for(self._arrived.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError: break
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line: break
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                _, path, _ = request_line.decode("latin-1").split(" ", 2)
+                try: payload = json.loads(body) if body else {}
+                except ValueError: payload = {}
+                self.requests.append((time.monotonic(), path, payload))
+                self._arrived.set()
+                if self.delay: await asyncio.sleep(self.delay)
+                response = json.dumps({"status": "ok", "retcode": 0, "data": {"message_id": len(self.requests)}}).encode()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(response) + response)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def summarize(seconds):
+    """返回 "中位数 / P90 / 最大值" 的毫秒文本"""
+    if not seconds: return "无样本"
+    samples = sorted(seconds)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return f"中位数 {pick(0.5) * 1000:7.1f} ms / P90 {pick(0.9) * 1000:7.1f} ms / 最大 {samples[-1] * 1000:7.1f} ms"
@@ -0,0 +1,70 @@
+"""tu.py 发送延迟微基准：每次新建客户端（改动前）vs 共享长连接客户端（改动后）。
+
+本地起一个 OneBot HTTP 桩，分别用两种方式发送 --sends 条群消息：先逐条顺序发送，再以 --burst 条为一批并发发送。
+统计每条消息从调用到收到回执的耗时，以及桩一共接受了多少条 TCP 连接。
+
+用法：python tools/tu_send_bench.py [--sends 300] [--burst 20] [--delay 0]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tu  # noqa: E402
+from onebot_stub import OneBotHttpStub, summarize  # noqa: E402
+
+
+async def send_with_fresh_client(group_id, message):
+    """改动前的 send_group_msg：每条消息新建一个 AsyncClient，发完即关闭"""
+    async with httpx.AsyncClient() as client:
+        response = await client.post(f"{tu.ONEBOT_HTTP_API_URL}/send_group_msg", json={"group_id": group_id, "message": message}, timeout=20)
+        response.raise_for_status()
+        response.json()
+
+
+async def timed(send, group_id):
+    started = time.perf_counter()
+    await send(group_id, [{"type": "text", "data": {"text": "bench"}}])
+    return time.perf_counter() - started
+
+
+async def run(stub, send, sends, burst):
+    stub.reset()
+    sequential = [await timed(send, i) for i in range(sends)]
+    sequential_connections = stub.connections
+    stub.reset()
+    concurrent = []
+    for start in range(0, sends, burst):
+        concurrent += await asyncio.gather(*(timed(send, i) for i in range(start, min(start + burst, sends))))
+    return sequential, sequential_connections, concurrent, stub.connections
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sends", type=int, default=300)
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--delay", type=float, default=0, help="OneBot 桩的回执延迟（秒）")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stub = OneBotHttpStub(args.delay)
+    tu.ONEBOT_HTTP_API_URL = await stub.start()
+    print(f"{args.sends} 条消息，并发批次 {args.burst} 条，回执延迟 {args.delay * 1000:.0f} ms")
+    try:
+        for name, send in (("改动前：每次新建客户端", send_with_fresh_client), ("改动后：共享长连接客户端", tu.send_group_msg)):
+            sequential, sequential_connections, concurrent, concurrent_connections = await run(stub, send, args.sends, args.burst)
+            print(f"\n[{name}]")
+            print(f"  顺序发送：{summarize(sequential)}，连接 {sequential_connections} 条")
+            print(f"  并发发送：{summarize(concurrent)}，连接 {concurrent_connections} 条")
+    finally:
+        await tu.close_http_clients()
+        await stub.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
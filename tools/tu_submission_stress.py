@@ -0,0 +1,293 @@
+"""tu.py 投稿并发压测：大量用户同时投稿，图片服务器故意放慢，检查会话锁、取消和超时之间的竞争。
+
+本地起一个 OneBot HTTP 桩（每个用户一个群，按群号统计回复）和一个慢速图片服务器（每张图分 --chunks 块，
+每块之间停 --chunk-delay 秒；/broken/ 下的图片只发一半就断开）。图库、临时目录都放在临时文件夹里，不碰真实鹿图。
+投稿去重不在本测试范围内（图片是构造的字节，不是真图），固定关闭。
+
+各组用户同时进行：
+  slow      先走完全部步骤，最后一步触发慢下载，作为背景负载
+  fast      在慢下载进行中走完全部步骤，记录每一步从收到消息到回复发出的耗时
+  cancel    画师名和“取消”同时到达
+  racefinal 最后一步 ID 和“取消”同时到达：要么投稿成功并落盘，要么取消且不落盘
+  duplicate 同一个 ID 消息连发两次：只保存一次
+  broken    图片下载中途断开：回复下载失败，不留临时文件
+  late      超过步骤超时（--step-timeout）才发画师名：会话已被静默取消，不再回复
+  edge      恰好在超时边界发画师名：收到下一步提示当且仅当会话仍在
+
+结束后等所有会话超时，检查：会话字典为空、没有残留 .part 文件和空画师目录、
+落盘文件与“投稿成功”回复一一对应且内容完整、没有未处理的异常。
+fast 组的步骤如果被慢下载拖住，耗时至少是一次完整下载；检查其 P90 低于单次下载耗时中位数的一半。
+步骤本身的耗时主要来自上百人同时发消息时排队等 OneBot 连接池，与下载快慢无关（--chunk-delay 0 可对照）。
+任一检查失败时以非零状态退出。
+
+用法：python tools/tu_submission_stress.py [--users 20] [--race-users 8] [--chunks 8] [--chunk-delay 0.2] [--step-timeout 1]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import tu  # noqa: E402
+from onebot_stub import OneBotHttpStub, summarize  # noqa: E402
+
+
+def image_bytes(user_id, size):
+    """每个用户的图片内容不同，保存后可以核对有没有串到别人的会话里"""
+    return (f"{user_id:010d}".encode() * (size // 10 + 1))[:size]
+
+
+class SlowImageServer:
+    def __init__(self, size, chunks, chunk_delay):
+        self.size, self.chunks, self.chunk_delay = size, chunks, chunk_delay
+        self.active = 0
+        self.max_active = 0
+        self.durations = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            while request_line := await reader.readline():
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass
+                path = request_line.decode("latin-1").split(" ")[1]
+                body = image_bytes(int(Path(path).stem), self.size)
+                broken = path.startswith("/broken/")
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: image/png\r\nContent-Length: %d\r\n\r\n" % len(body))
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                started = time.monotonic()
+                try:
+                    step = -(-len(body) // self.chunks)
+                    for offset in range(0, len(body), step):
+                        if broken and offset >= len(body) // 2: return
+                        await asyncio.sleep(self.chunk_delay)
+                        writer.write(body[offset:offset + step])
+                        await writer.drain()
+                finally:
+                    self.active -= 1
+                self.durations.append(time.monotonic() - started)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class Stress:
+    def __init__(self, stub, images, image_url):
+        self.stub, self.images, self.image_url = stub, images, image_url
+        self.step_latencies = []  # fast 组：(耗时, 当时进行中的下载数)
+        self.outcomes = {}        # 用户 -> (分组, 额外信息)
+
+    def replies(self, user_id):
+        return [seg["data"]["text"] for _, _, payload in self.stub.requests if payload.get("group_id") == user_id
+                for seg in payload.get("message", []) if seg.get("type") == "text"]
+
+    async def send(self, user_id, text=None, image=None):
+        if image:
+            data = {"raw_message": f"[CQ:image,file={Path(image).name},url={image}]", "message": [{"type": "image", "data": {"url": image}}]}
+        else:
+            data = {"raw_message": text, "message": [{"type": "text", "data": {"text": text}}]}
+        data.update(post_type="message", message_type="group", group_id=user_id, user_id=user_id)
+        started = time.perf_counter()
+        await tu.handle_message(data)
+        return time.perf_counter() - started
+
+    async def prepare(self, user_id, group, path="img", record=False):
+        """走到只差最后一步 ID 为止"""
+        self.outcomes[user_id] = (group, None)
+        for kwargs in ({"text": "鹿图投稿"}, {"image": f"{self.image_url}/{path}/{user_id}.png"}, {"text": f"画师{user_id}"}, {"text": "22"}):
+            elapsed = await self.send(user_id, **kwargs)
+            if record: self.step_latencies.append((elapsed, self.images.active))
+
+    async def slow(self, user_id):
+        await self.prepare(user_id, "slow")
+        return asyncio.create_task(self.send(user_id, str(user_id)))
+
+    async def fast(self, user_id):
+        await self.prepare(user_id, "fast", record=True)
+        await self.send(user_id, str(user_id))
+
+    async def cancel(self, user_id):
+        self.outcomes[user_id] = ("cancel", None)
+        await self.send(user_id, "鹿图投稿")
+        await self.send(user_id, image=f"{self.image_url}/img/{user_id}.png")
+        messages = [f"画师{user_id}", "取消"]
+        random.shuffle(messages)
+        await asyncio.gather(*(self.send(user_id, m) for m in messages))
+
+    async def racefinal(self, user_id):
+        await self.prepare(user_id, "racefinal")
+        messages = [str(user_id), "取消投稿"]
+        random.shuffle(messages)
+        await asyncio.gather(*(self.send(user_id, m) for m in messages))
+
+    async def duplicate(self, user_id):
+        await self.prepare(user_id, "duplicate")
+        await asyncio.gather(self.send(user_id, str(user_id)), self.send(user_id, str(user_id)))
+
+    async def broken(self, user_id):
+        await self.prepare(user_id, "broken", path="broken")
+        await self.send(user_id, str(user_id))
+
+    async def late(self, user_id, step_timeout):
+        self.outcomes[user_id] = ("late", None)
+        await self.send(user_id, "鹿图投稿")
+        await self.send(user_id, image=f"{self.image_url}/img/{user_id}.png")
+        await asyncio.sleep(step_timeout + 0.3)
+        await self.send(user_id, f"画师{user_id}")
+
+    async def edge(self, user_id, step_timeout):
+        await self.send(user_id, "鹿图投稿")
+        # 超时任务在处理图片这一步时登记，从发图之前开始计时，前后各留一点抖动，两种结局都会出现
+        started = time.monotonic()
+        await self.send(user_id, image=f"{self.image_url}/img/{user_id}.png")
+        await asyncio.sleep(started + step_timeout + random.uniform(-0.05, 0.05) - time.monotonic())
+        await self.send(user_id, f"画师{user_id}")
+        # 这一步返回时，会话要么还在（已回复下一步提示），要么已被超时清掉（没有回复）
+        self.outcomes[user_id] = ("edge", tu.USER_SESSIONS.get(user_id) is not None)
+
+
+class ErrorCollector(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.expected = 0
+        self.unexpected = []
+
+    def emit(self, record):
+        if record.getMessage().startswith("下载图片失败"): self.expected += 1
+        else: self.unexpected.append(self.format(record))
+
+
+def check_results(stress, images, gallery_root, temp_dir, size, errors, loop_errors):
+    failures = []
+    def check(ok, text):
+        print(f"  [{'通过' if ok else '失败'}] {text}")
+        if not ok: failures.append(text)
+
+    saved = {}
+    for artist_dir in (d for d in gallery_root.iterdir() if d.is_dir()) if gallery_root.is_dir() else ():
+        for path in artist_dir.iterdir():
+            saved[int(artist_dir.name.removeprefix("画师"))] = path
+    empty_dirs = [d for d in gallery_root.iterdir() if d.is_dir() and not any(d.iterdir())] if gallery_root.is_dir() else []
+    leftovers = list(temp_dir.glob("*.part")) if temp_dir.is_dir() else []
+
+    check(not tu.USER_SESSIONS, f"全部会话已结束（残留 {len(tu.USER_SESSIONS)} 个）")
+    check(not leftovers, f"没有残留临时文件（{len(leftovers)} 个）")
+    check(not empty_dirs, f"没有空画师目录（{len(empty_dirs)} 个）")
+    check(len(tu.GALLERY.all_images) == len(saved), f"索引登记 {len(tu.GALLERY.all_images)} 张，磁盘上 {len(saved)} 张")
+
+    mismatched, by_group = [], {}
+    for user_id, (group, alive) in stress.outcomes.items():
+        replies = stress.replies(user_id)
+        successes = sum(text.startswith("投稿成功") for text in replies)
+        cancelled = any(text.startswith("投稿流程已取消") for text in replies)
+        prompted = any(text.startswith("请标明图片来源") for text in replies)
+        path = saved.get(user_id)
+        intact = path is not None and path.name == f"B_{user_id}.png" and path.read_bytes() == image_bytes(user_id, size)
+        expected = {
+            "slow": successes == 1 and intact,
+            "fast": successes == 1 and intact,
+            "duplicate": successes == 1 and intact,
+            "racefinal": (successes == 1 and intact and not cancelled) or (successes == 0 and path is None and cancelled),
+            "cancel": successes == 0 and path is None and cancelled,
+            "broken": successes == 0 and path is None and any(text.startswith("抱歉，下载图片失败") for text in replies),
+            "late": successes == 0 and path is None and not prompted,
+            "edge": successes == 0 and path is None and prompted == alive,
+        }[group]
+        by_group.setdefault(group, [0, 0])[0] += 1
+        if expected: by_group[group][1] += 1
+        else: mismatched.append((user_id, group, replies))
+    for group, (total, ok) in by_group.items():
+        extra = ""
+        if group == "racefinal": extra = f"，其中投稿成功 {sum(1 for u, (g, _) in stress.outcomes.items() if g == group and u in saved)} 个"
+        if group == "edge": extra = f"，其中赶在超时前 {sum(1 for g, alive in stress.outcomes.values() if g == group and alive)} 个"
+        check(ok == total, f"{group:<9} 组结果符合预期 {ok}/{total}{extra}")
+    for user_id, group, replies in mismatched[:5]:
+        print(f"      用户 {user_id}（{group}）收到：{replies}，文件：{saved.get(user_id)}")
+    successes_total = sum(text.startswith("投稿成功") for user_id in stress.outcomes for text in stress.replies(user_id))
+    check(successes_total == len(saved), f"“投稿成功”回复 {successes_total} 条，落盘文件 {len(saved)} 个")
+
+    latencies = [elapsed for elapsed, _ in stress.step_latencies]
+    overlapped = sum(1 for _, active in stress.step_latencies if active)
+    p90 = sorted(latencies)[int(0.9 * len(latencies))] if latencies else 0
+    download = sorted(images.durations)[len(images.durations) // 2] if images.durations else 0
+    check(p90 < download / 2 and overlapped, f"fast 组步骤 P90 {p90 * 1000:.1f} ms < 单次下载中位数的一半 {download * 500:.0f} ms，"
+                                             f"其中 {overlapped}/{len(latencies)} 步发生在慢下载进行中")
+    check(not errors.unexpected, f"没有意外的错误日志（下载失败 {errors.expected} 条属预期，意外 {len(errors.unexpected)} 条）")
+    for text in errors.unexpected[:3]: print(f"      {text}")
+    check(not loop_errors, f"没有未处理的任务异常（{len(loop_errors)} 个）")
+    for context in loop_errors[:3]: print(f"      {context.get('message')}: {context.get('exception')!r}")
+    return failures
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="slow、fast 组各自的人数")
+    parser.add_argument("--race-users", type=int, default=8, help="其余各竞争组的人数")
+    parser.add_argument("--size", type=int, default=256 * 1024, help="每张图片的字节数")
+    parser.add_argument("--chunks", type=int, default=8)
+    parser.add_argument("--chunk-delay", type=float, default=0.2, help="图片服务器每块之间的停顿（秒）")
+    parser.add_argument("--step-timeout", type=float, default=1.0, help="替换 SUBMISSION_STEP_TIMEOUT，让超时竞争在几秒内发生")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+    errors = ErrorCollector()
+    tu.logger.addHandler(errors)
+    tu.logger.propagate = False
+    loop_errors = []
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: loop_errors.append(context))
+
+    stub, images = OneBotHttpStub(), SlowImageServer(args.size, args.chunks, args.chunk_delay)
+    tu.ONEBOT_HTTP_API_URL = await stub.start()
+    image_url = await images.start()
+    with tempfile.TemporaryDirectory(prefix="tu_stress_") as workdir:
+        gallery_root, temp_dir = Path(workdir) / tu.IMAGE_ROOT_DIR_NAME, Path(workdir) / tu.SUBMISSION_TEMP_DIR_NAME
+        tu.STORAGE_MODE, tu.Image = "folders", None
+        tu.GALLERY, tu.SUBMISSION_TEMP_DIR = tu.GalleryIndex(gallery_root), temp_dir
+        tu.SUBMISSION_AWAIT_IMAGE_TIMEOUT = tu.SUBMISSION_STEP_TIMEOUT = args.step_timeout
+        stress = Stress(stub, images, image_url)
+        ids = iter(range(10001, 10**6))
+        take = lambda count: [next(ids) for _ in range(count)]
+
+        print(f"slow/fast 各 {args.users} 人，其余各组 {args.race_users} 人；每张图 {args.size // 1024} KiB，"
+              f"分 {args.chunks} 块、每块间隔 {args.chunk_delay * 1000:.0f} ms；下载连接池 {tu.DOWNLOAD_POOL_LIMITS.max_connections}，步骤超时 {args.step_timeout:g} 秒")
+        started = time.monotonic()
+        try:
+            background = await asyncio.gather(*(stress.slow(u) for u in take(args.users)))
+            await asyncio.sleep(args.chunk_delay)  # 让慢下载先占住连接池
+            await asyncio.gather(
+                *(stress.fast(u) for u in take(args.users)),
+                *(stress.cancel(u) for u in take(args.race_users)),
+                *(stress.racefinal(u) for u in take(args.race_users)),
+                *(stress.duplicate(u) for u in take(args.race_users)),
+                *(stress.broken(u) for u in take(args.race_users)),
+                *(stress.late(u, args.step_timeout) for u in take(args.race_users)),
+                *(stress.edge(u, args.step_timeout) for u in take(args.race_users)),
+                *background)
+            elapsed = time.monotonic() - started
+            await asyncio.sleep(args.step_timeout + 0.5)  # 等 edge 组留下的会话自然超时
+            print(f"全部流程 {elapsed:.1f} 秒完成；图片下载 {len(images.durations)} 次，单次 {summarize(images.durations)}，最多同时 {images.max_active} 个")
+            print(f"fast 组步骤耗时（收到消息→回复发出）：{summarize([e for e, _ in stress.step_latencies])}")
+            failures = check_results(stress, images, gallery_root, temp_dir, args.size, errors, loop_errors)
+        finally:
+            await tu.close_http_clients()
+            await images.close()
+            await stub.close()
+    print("\n全部检查通过。" if not failures else f"\n{len(failures)} 项检查失败。")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
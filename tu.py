@@ -1,26 +1,70 @@
 import asyncio
+import hashlib
+import io
 import json
 import logging
 import os
 import random
 import re
-from dataclasses import dataclass
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 import httpx
 import websockets
 
+try:
+    import h2  # noqa: F401  httpx 的 HTTP/2 支持依赖 h2，未安装时退回 HTTP/1.1
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    from PIL import Image  # 可选依赖，用于感知哈希去重和生成发送用的压缩图
+except ImportError:
+    Image = None
+
 # --- 1. 核心配置 ---
 WEBSOCKET_URI = "ws://127.0.0.1:15400"
 # !!! 重要：请在 NapCat 设置中找到您的 HTTP 服务端口并替换下面的 15300 !!!
 ONEBOT_HTTP_API_URL = "http://127.0.0.1:15300"
 
 IMAGE_ROOT_DIR_NAME = "鹿图"
+# 投稿下载中的临时文件目录，与图库放在同一磁盘上，保存时原子改名移入画师目录
+SUBMISSION_TEMP_DIR_NAME = "鹿图_incoming"
 IMAGE_SIZE_LIMIT_MB = 50
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 SEND_TIMEOUT_SECONDS = 5
 SUBMISSION_AWAIT_IMAGE_TIMEOUT = 60
 SUBMISSION_STEP_TIMEOUT = 30
+GALLERY_REFRESH_SECONDS = 60
+# 存储方式："folders" 为 鹿图/[画师]/[来源]_[ID].ext 目录结构；"blobs" 为按内容哈希命名的图片仓库 + 元数据库
+# 旧目录可用 python tu.py --import-legacy 一次性导入仓库
+STORAGE_MODE = "folders"
+BLOB_STORE_DIR_NAME = "鹿图_blobs"
+# True：所有图片等概率抽取（图多的画师更容易被抽到）；False：先等概率抽画师，再抽该画师的图
+RECOMMEND_WEIGHT_BY_IMAGE = False
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'bmp')
+
+# 连接池：发消息和下载图片各用一个，互不抢占连接
+ONEBOT_POOL_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=60)
+DOWNLOAD_POOL_LIMITS = httpx.Limits(max_connections=4, max_keepalive_connections=4, keepalive_expiry=30)
+# 感知哈希去重：两张图 dHash 的汉明距离不超过该值即视为同一作品
+DEDUPE_INDEX_FILE = "鹿图_hashes.json"
+DEDUPE_MAX_DISTANCE = 6
+DEDUPE_BATCH_SIZE = 256
+# 发送用压缩图：长边缩到 VARIANT_MAX_EDGE 以内并重新编码，尽量控制在 VARIANT_TARGET_KB 以内
+VARIANT_CACHE_DIR_NAME = "鹿图_variants"
+VARIANT_MAX_EDGE = 2048
+VARIANT_TARGET_KB = 1500
+VARIANT_FORMAT = "JPEG"  # 也可以改为 "WEBP"
+DOWNLOAD_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'}
 
 # 日志设置
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] - %(message)s")
@@ -37,77 +81,553 @@ class SubmissionSession:
     artist_name: Optional[str] = None
     source_prefix: Optional[str] = None
     artwork_id: Optional[str] = None
+    # 每个用户一把锁，只串行化同一用户的步骤；会话字典本身只在事件循环中无 await 地读写，不需要全局锁
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
 
 USER_SESSIONS: Dict[int, SubmissionSession] = {}
-_session_lock = asyncio.Lock()
 SOURCE_MAP = {"11": "X", "22": "B", "33": "P", "44": "BV"}
 
-# --- 3. HTTP API 发送模块 ---
-async def send_group_msg(group_id: int, message: list):
-    async with httpx.AsyncClient() as client:
-        try:
-            payload = {"group_id": group_id, "message": message}
-            url = f"{ONEBOT_HTTP_API_URL}/send_group_msg"
-            response = await client.post(url, json=payload, timeout=20)
-            response.raise_for_status()
-            response_data = response.json()
-            if response_data.get("status") == "ok":
-                logger.info(f"成功向群 {group_id} 发送消息。")
+# --- 3. 鹿图索引 ---
+@dataclass
+class GalleryImage:
+    path: Path
+    artist: str
+    source_text: str
+    id_text: str
+    blob: Optional[str] = None  # 仓库模式下的内容哈希
+
+    @classmethod
+    def from_path(cls, path: Path, artist: str, blob: Optional[str] = None) -> 'GalleryImage':
+        return cls(path, artist, *describe_image_file(path), blob)
+
+    @property
+    def key(self) -> str:
+        """去重索引和压缩图缓存使用的键：仓库模式下直接用内容哈希"""
+        return self.blob or f"{self.artist}/{self.path.name}"
+
+SOURCE_TEXT_MAP = {"B": "b站动态", "P": "Pixiv", "X": "X动态", "BV": "b站视频"}
+
+def describe_image_file(path: Path) -> Tuple[str, str]:
+    """从 [来源]_[ID].ext 形式的文件名解析出来源描述和作品ID"""
+    prefix, _, rest = path.stem.partition('_')
+    prefix = prefix.upper()
+    if not rest or prefix not in SOURCE_TEXT_MAP: return "未知来源", "未知"
+    if prefix == "BV": return SOURCE_TEXT_MAP[prefix], rest
+    match = re.match(r"\d+", rest)
+    return SOURCE_TEXT_MAP[prefix], match.group(0) if match else "未知"
+
+class GalleryIndex:
+    """鹿图内存索引：画师 -> 图片条目。启动时建立一次，之后按画师目录 mtime 或投稿增量更新"""
+    def __init__(self, base_path: Path):
+        self.base_path = base_path
+        self.artists: Dict[str, List[GalleryImage]] = {}
+        self.artist_names: List[str] = []      # 至少有一张图的画师
+        self.all_images: List[GalleryImage] = []
+        self.dir_mtimes: Dict[str, float] = {}
+
+    def _scan_artist(self, artist_path: Path) -> List[GalleryImage]:
+        return [GalleryImage.from_path(f, artist_path.name)
+                for f in artist_path.iterdir() if f.is_file() and f.name.lower().endswith(IMAGE_EXTENSIONS)]
+
+    def refresh(self) -> bool:
+        """只重新扫描 mtime 变化过的画师目录；返回索引是否有变化"""
+        if not self.base_path.is_dir():
+            changed = bool(self.artists)
+            self.artists, self.artist_names, self.all_images, self.dir_mtimes = {}, [], [], {}
+            return changed
+        artists, dir_mtimes, changed = {}, {}, False
+        with os.scandir(self.base_path) as entries:
+            for entry in entries:
+                if not entry.is_dir(): continue
+                mtime = entry.stat().st_mtime
+                dir_mtimes[entry.name] = mtime
+                if self.dir_mtimes.get(entry.name) == mtime and entry.name in self.artists:
+                    artists[entry.name] = self.artists[entry.name]
+                else:
+                    artists[entry.name] = self._scan_artist(Path(entry.path)); changed = True
+        if changed or artists.keys() != self.artists.keys():
+            self._publish(artists, dir_mtimes)
+            return True
+        return False
+
+    def _publish(self, artists: Dict[str, List[GalleryImage]], dir_mtimes: Dict[str, float]):
+        # 整体替换引用，推荐时永远看到一份完整的索引
+        self.artists, self.dir_mtimes = artists, dir_mtimes
+        self.artist_names = [name for name, images in artists.items() if images]
+        self.all_images = [image for images in artists.values() for image in images]
+
+    def add(self, image: GalleryImage):
+        """投稿保存后直接登记新图，无需重新扫描"""
+        images = self.artists.setdefault(image.artist, [])
+        images[:] = [i for i in images if i.path != image.path]
+        if image.artist not in self.artist_names: self.artist_names.append(image.artist)
+        images.append(image)
+        self.all_images = [i for i in self.all_images if not (i.path == image.path and i.artist == image.artist)]
+        self.all_images.append(image)
+        if image.blob is None: self.dir_mtimes[image.artist] = image.path.parent.stat().st_mtime
+
+    def find(self, key: str) -> Optional[GalleryImage]:
+        return next((image for image in self.all_images if image.key == key), None)
+
+    def is_available(self) -> bool:
+        return self.base_path.is_dir()
+
+    def choose(self, weight_by_image: bool = RECOMMEND_WEIGHT_BY_IMAGE) -> Optional[GalleryImage]:
+        if weight_by_image:
+            return random.choice(self.all_images) if self.all_images else None
+        if not self.artist_names: return None
+        return random.choice(self.artists[random.choice(self.artist_names)])
+
+class BlobStore:
+    """按内容哈希存放图片的仓库：[根]/ab/cd/<sha256>.ext，画师/来源/ID 到图片的映射记录在 SQLite 元数据库中"""
+    def __init__(self, root: Path):
+        self.root = root
+        self.db_path = root / "meta.db"
+        self.temp_dir = root / "tmp"
+
+    def _connect(self) -> sqlite3.Connection:
+        self.root.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS images (
+            artist TEXT NOT NULL, source TEXT NOT NULL, artwork_id TEXT NOT NULL, blob TEXT NOT NULL, ext TEXT NOT NULL,
+            added_at REAL NOT NULL, PRIMARY KEY (artist, source, artwork_id))""")
+        conn.execute("CREATE INDEX IF NOT EXISTS images_blob ON images (blob)")
+        return conn
+
+    def blob_path(self, digest: str, ext: str) -> Path:
+        return self.root / digest[:2] / digest[2:4] / f"{digest}{ext}"
+
+    @staticmethod
+    def hash_file(path: Path) -> str:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''): sha.update(chunk)
+        return sha.hexdigest()
+
+    def has_blob(self, digest: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM images WHERE blob = ? LIMIT 1", (digest,)).fetchone() is not None
+
+    def put(self, path: Path, ext: str, move: bool = False) -> Tuple[str, Path]:
+        """把文件放进仓库，已有相同内容时不重复存储；返回 (内容哈希, 仓库内路径)"""
+        digest = self.hash_file(path)
+        target = self.blob_path(digest, ext.lower())
+        if target.exists():
+            if move: path.unlink(missing_ok=True)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if move: os.replace(path, target)
             else:
-                logger.warning(f"发送消息到群 {group_id} 的业务状态异常: {response_data}")
-        except httpx.RequestError as e:
-            logger.error(f"发送消息到群 {group_id} 时发生网络错误: {e}")
+                shutil.copyfile(path, target.with_suffix('.tmp'))
+                os.replace(target.with_suffix('.tmp'), target)
+        return digest, target
+
+    def register(self, rows: List[Tuple[str, str, str, str, str]]):
+        """登记 (画师, 来源, ID, 内容哈希, 扩展名)，同一画师/来源/ID 再次登记时指向新图片"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO images (artist, source, artwork_id, blob, ext, added_at) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(*row, now) for row in rows])
+
+    def images(self) -> List[GalleryImage]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT artist, source, artwork_id, blob, ext FROM images ORDER BY artist").fetchall()
+        return [GalleryImage(self.blob_path(blob, ext), artist, *describe_image_file(Path(f"{source}_{artwork_id}{ext}")), blob)
+                for artist, source, artwork_id, blob, ext in rows]
+
+    def import_legacy(self, base_path: Path) -> int:
+        """一次遍历旧的 鹿图/[画师]/ 目录，复制进仓库并批量写入元数据，原目录保持不变"""
+        rows = []
+        for artist_path in base_path.iterdir():
+            if not artist_path.is_dir(): continue
+            for f in artist_path.iterdir():
+                if not (f.is_file() and f.name.lower().endswith(IMAGE_EXTENSIONS)): continue
+                prefix, _, artwork_id = f.stem.partition('_')
+                source = prefix.upper() if artwork_id and prefix.upper() in SOURCE_TEXT_MAP else ""
+                digest, _ = self.put(f, f.suffix)
+                rows.append((artist_path.name, source, artwork_id if source else f.stem, digest, f.suffix.lower()))
+        self.register(rows)
+        return len(rows)
+
+class BlobGalleryIndex(GalleryIndex):
+    """仓库模式的鹿图索引：直接读元数据库，不遍历目录树"""
+    def __init__(self, store: BlobStore):
+        super().__init__(store.root)
+        self.store = store
+        self._signature = None
+
+    def refresh(self) -> bool:
+        images = self.store.images()
+        signature = [(image.artist, image.blob, image.path.name) for image in images]
+        if signature == self._signature: return False
+        self._signature = signature
+        artists: Dict[str, List[GalleryImage]] = {}
+        for image in images: artists.setdefault(image.artist, []).append(image)
+        self._publish(artists, {})
+        return True
+
+    def is_available(self) -> bool:
+        return self.store.db_path.is_file()
+
+BLOBS = BlobStore(Path(__file__).parent / BLOB_STORE_DIR_NAME)
+SUBMISSION_TEMP_DIR = Path(__file__).parent / SUBMISSION_TEMP_DIR_NAME
+GALLERY = BlobGalleryIndex(BLOBS) if STORAGE_MODE == "blobs" else GalleryIndex(Path(__file__).parent / IMAGE_ROOT_DIR_NAME)
+
+async def refresh_gallery_periodically():
+    while True:
+        await asyncio.sleep(GALLERY_REFRESH_SECONDS)
+        try:
+            if await asyncio.to_thread(GALLERY.refresh):
+                logger.info(f"鹿图索引已更新：{len(GALLERY.artist_names)} 位画师，{len(GALLERY.all_images)} 张图片。")
+                # 运行期间直接拷进图库的图片也要进去重索引；放到后台，补算期间不耽误下一次刷新
+                if Image is not None: asyncio.create_task(DEDUPE.sync(GALLERY))
+        except Exception:
+            logger.exception("刷新鹿图索引失败。")
+
+# --- 4. 感知哈希去重 ---
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """图片解码等 CPU 密集任务共用的进程池"""
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor()
+    return _process_pool
+
+def compute_dhash(path: str) -> int:
+    """64 位差值哈希：缩成 9x8 灰度图，比较每行相邻像素的明暗"""
+    with Image.open(path) as img:
+        pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+class BKTree:
+    """按汉明距离组织的 BK 树，查找阈值内的相似哈希时只需访问少量节点"""
+    def __init__(self):
+        self.root = None  # 节点: [哈希, {距离: 子节点}, [键]]
+
+    def add(self, image_hash: int, key: str):
+        if self.root is None:
+            self.root = [image_hash, {}, [key]]; return
+        node = self.root
+        while True:
+            distance = (image_hash ^ node[0]).bit_count()
+            if distance == 0:
+                node[2].append(key); return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [image_hash, {}, [key]]; return
+            node = child
+
+    def search(self, image_hash: int, max_distance: int) -> List[Tuple[int, int, str]]:
+        """返回 [(距离, 节点哈希, 键)]，按距离升序"""
+        results, stack = [], [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = (image_hash ^ node[0]).bit_count()
+            if distance <= max_distance:
+                results.extend((distance, node[0], key) for key in node[2])
+            for child_distance, child in node[1].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        return sorted(results)
+
+class DedupeIndex:
+    """鹿图去重索引：相对路径 -> (mtime, dHash)，持久化为 JSON，内存里用 BK 树查找近似重复"""
+    def __init__(self, index_path: Path):
+        self.index_path = index_path
+        self.entries: Dict[str, Tuple[float, int]] = {}
+        self.tree = BKTree()
+        self.save_lock = asyncio.Lock()  # 投稿、补算可能同时保存，串行写盘，共用的临时文件才不会被互相覆盖或删除
+        self.sync_lock = asyncio.Lock()  # 启动补算和刷新后的增量补算依次进行，同一张图不会算两遍
+
+    def _read(self) -> dict:
+        if not self.index_path.is_file(): return {}
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f: return json.load(f)
         except Exception:
-            logger.exception(f"发送消息到群 {group_id} 时发生未知错误。")
+            logger.exception(f"读取去重索引 {self.index_path.name} 失败，将重新计算。")
+            return {}
+
+    def _write(self, payload: dict):
+        temp_path = self.index_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f: json.dump(payload, f, ensure_ascii=False)
+        os.replace(temp_path, self.index_path)
+
+    async def save(self):
+        # 快照在事件循环里取，写盘放到线程，避免与并发的 add 冲突；拿到锁后再取快照，最后写入的总是最新内容
+        async with self.save_lock:
+            payload = {key: [mtime, f"{image_hash:016x}"] for key, (mtime, image_hash) in self.entries.items()}
+            await asyncio.to_thread(self._write, payload)
+
+    def add(self, key: str, mtime: float, image_hash: int):
+        # BK 树不支持删除，旧节点留在树里，查找时用 entries 校验是否仍然有效
+        self.entries[key] = (mtime, image_hash)
+        self.tree.add(image_hash, key)
+
+    def find_similar(self, image_hash: int) -> Optional[Tuple[str, int]]:
+        """返回最相近的已有图片 (键, 距离)，没有则返回 None"""
+        for distance, node_hash, key in self.tree.search(image_hash, DEDUPE_MAX_DISTANCE):
+            entry = self.entries.get(key)
+            if entry and entry[1] == node_hash: return key, distance
+        return None
+
+    async def backfill(self, gallery: 'GalleryIndex'):
+        """启动时载入已保存的哈希，再为图库中尚未计算或已修改的图片补算"""
+        for key, (mtime, hex_hash) in (await asyncio.to_thread(self._read)).items():
+            self.add(key, mtime, int(hex_hash, 16))
+        logger.info(f"去重索引已加载 {len(self.entries)} 条。")
+        await self.sync(gallery, check_mtime=True)
+
+    async def sync(self, gallery: 'GalleryIndex', check_mtime: bool = False):
+        """为图库中还没有哈希的图片补算（check_mtime 时连已修改的一起重算），放到进程池并行计算；移出图库的条目一并删除"""
+        async with self.sync_lock:
+            images = [image for image in gallery.all_images if check_mtime or image.key not in self.entries]
+            def stat_images():
+                mtimes = []
+                for image in images:
+                    try: mtimes.append(image.path.stat().st_mtime)
+                    except OSError: mtimes.append(None)  # 扫描之后又被删掉的文件
+                return mtimes
+            mtimes = await asyncio.to_thread(stat_images)
+            current = {image.key: (image.path, mtime) for image, mtime in zip(images, mtimes) if mtime is not None}
+            stale = set(self.entries) - {image.key for image in gallery.all_images}
+            for key in stale: del self.entries[key]
+            todo = [(key, path, mtime) for key, (path, mtime) in current.items() if self.entries.get(key, (None,))[0] != mtime]
+            if not todo:
+                if stale or check_mtime: await self.try_save()
+                return
+            logger.info(f"去重索引需补算 {len(todo)} 张图片的哈希。")
+            loop = asyncio.get_running_loop()
+            for start in range(0, len(todo), DEDUPE_BATCH_SIZE):
+                batch = todo[start:start + DEDUPE_BATCH_SIZE]
+                hashes = await asyncio.gather(*(loop.run_in_executor(get_process_pool(), compute_dhash, str(path)) for _, path, _ in batch), return_exceptions=True)
+                for (key, path, mtime), image_hash in zip(batch, hashes):
+                    if isinstance(image_hash, Exception): logger.warning(f"计算 {path} 的哈希失败: {image_hash}")
+                    else: self.add(key, mtime, image_hash)
+                await self.try_save()
+            logger.info(f"去重索引补算完成，共 {len(self.entries)} 张图片。")
 
-async def download_image(url: str) -> Optional[bytes]:
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/108.0.0.0 Safari/537.36'}
+    async def try_save(self):
+        """保存失败只记日志，内存中的索引照常可用，下一次保存会写入完整内容"""
+        try:
+            await self.save()
+        except Exception:
+            logger.exception(f"保存去重索引 {self.index_path.name} 失败。")
+
+DEDUPE = DedupeIndex(Path(__file__).parent / DEDUPE_INDEX_FILE)
+
+# --- 5. 发送用压缩图缓存 ---
+def build_send_variant(source: str, cache_dir: str) -> Tuple[str, str]:
+    """在进程池中运行：计算原图内容哈希并生成压缩图，返回 (内容哈希, 压缩图路径)；原图本身足够小或是动图时路径为空串"""
+    with open(source, 'rb') as f: data = f.read()
+    digest = hashlib.sha256(data).hexdigest()
+    target = os.path.join(cache_dir, digest[:2], digest + ('.webp' if VARIANT_FORMAT == "WEBP" else '.jpg'))
+    if os.path.exists(target): return digest, target
+    budget = VARIANT_TARGET_KB * 1024
+    with Image.open(io.BytesIO(data)) as img:
+        if getattr(img, 'is_animated', False): return digest, ""
+        if len(data) <= budget and max(img.size) <= VARIANT_MAX_EDGE: return digest, ""
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        else:
+            img = img.convert('RGB')
+        edge = VARIANT_MAX_EDGE
+        while True:
+            resized = img.copy()
+            resized.thumbnail((edge, edge), Image.LANCZOS)
+            for quality in (90, 80, 70, 60, 50):
+                buffer = io.BytesIO()
+                resized.save(buffer, VARIANT_FORMAT, quality=quality)
+                if buffer.tell() <= budget: break
+            if buffer.tell() <= budget or edge <= 512: break
+            edge = int(edge * 0.75)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = target + '.tmp'
+    with open(temp_path, 'wb') as f: f.write(buffer.getvalue())
+    os.replace(temp_path, target)
+    return digest, target
+
+class VariantCache:
+    """原图 -> 压缩图的缓存清单，按原图 mtime 判断是否过期，压缩图按内容哈希命名，同图不同画师共用一份"""
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = cache_dir
+        self.manifest_path = cache_dir / "manifest.json"
+        self.entries: Dict[str, dict] = {}  # 图片键 -> {"mtime", "sha256", "variant"}
+        self.pending: Dict[str, asyncio.Task] = {}
+        self.write_lock = asyncio.Lock()  # 几张压缩图同时生成完时串行写清单，共用的临时文件才不会被互相覆盖或删除
+
+    def load(self):
+        if not self.manifest_path.is_file(): return
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f: self.entries = json.load(f)
+        except Exception:
+            logger.exception("读取压缩图清单失败，将按需重新生成。")
+
+    def _write(self, payload: dict):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_path = self.manifest_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f: json.dump(payload, f, ensure_ascii=False)
+        os.replace(temp_path, self.manifest_path)
+
+    def lookup(self, image: GalleryImage) -> Optional[Path]:
+        """返回可直接发送的文件：有效的压缩图，或无需压缩时的原图；尚未生成时安排后台生成并返回 None"""
+        entry = self.entries.get(image.key)
+        try:
+            mtime = image.path.stat().st_mtime
+        except OSError:
+            return None
+        if entry and entry["mtime"] == mtime and (not entry["variant"] or os.path.exists(entry["variant"])):
+            return Path(entry["variant"]) if entry["variant"] else image.path
+        self.schedule(image)
+        return None
+
+    def schedule(self, image: GalleryImage):
+        if Image is None or image.key in self.pending: return
+        self.pending[image.key] = asyncio.create_task(self._generate(image))
+
+    async def _generate(self, image: GalleryImage):
+        try:
+            mtime = image.path.stat().st_mtime
+            digest, variant = await asyncio.get_running_loop().run_in_executor(
+                get_process_pool(), build_send_variant, str(image.path), str(self.cache_dir))
+            self.entries[image.key] = {"mtime": mtime, "sha256": digest, "variant": variant}
+            async with self.write_lock:
+                await asyncio.to_thread(self._write, dict(self.entries))
+            logger.info(f"已生成 {image.key} 的发送用压缩图。" if variant else f"{image.key} 无需压缩，直接发送原图。")
+        except Exception:
+            logger.exception(f"生成 {image.key} 的压缩图失败。")
+        finally:
+            self.pending.pop(image.key, None)
+
+VARIANTS = VariantCache(Path(__file__).parent / VARIANT_CACHE_DIR_NAME)
+LAST_RECOMMENDED: Dict[int, GalleryImage] = {}  # 群号 -> 最近一次推荐的图片，供“鹿图原图”使用
+
+# --- 6. HTTP API 发送模块 ---
+_http_clients: Dict[str, httpx.AsyncClient] = {}
+
+def get_onebot_client() -> httpx.AsyncClient:
+    """发往 NapCat 的长连接客户端，进程内共享"""
+    client = _http_clients.get("onebot")
+    if client is None or client.is_closed:
+        client = _http_clients["onebot"] = httpx.AsyncClient(base_url=ONEBOT_HTTP_API_URL, timeout=20, limits=ONEBOT_POOL_LIMITS)
+    return client
+
+def get_download_client() -> httpx.AsyncClient:
+    """下载投稿图片用的客户端，独立连接池，CDN 支持时走 HTTP/2"""
+    client = _http_clients.get("download")
+    if client is None or client.is_closed:
+        client = _http_clients["download"] = httpx.AsyncClient(
+            headers=DOWNLOAD_HEADERS, timeout=60, follow_redirects=True, http2=HTTP2_AVAILABLE, limits=DOWNLOAD_POOL_LIMITS)
+    return client
+
+async def close_http_clients():
+    for client in _http_clients.values():
+        await client.aclose()
+    _http_clients.clear()
+
+async def send_group_msg(group_id: int, message: list):
+    try:
+        payload = {"group_id": group_id, "message": message}
+        response = await get_onebot_client().post("/send_group_msg", json=payload)
+        response.raise_for_status()
+        response_data = response.json()
+        if response_data.get("status") == "ok":
+            logger.info(f"成功向群 {group_id} 发送消息。")
+        else:
+            logger.warning(f"发送消息到群 {group_id} 的业务状态异常: {response_data}")
+    except httpx.RequestError as e:
+        logger.error(f"发送消息到群 {group_id} 时发生网络错误: {e}")
+    except Exception:
+        logger.exception(f"发送消息到群 {group_id} 时发生未知错误。")
+
+class ImageTooLargeError(Exception):
+    """投稿图片超过 IMAGE_SIZE_LIMIT_MB"""
+
+# mkstemp 建的文件只有属主可读（0600），入库前改回普通 open() 按 umask 得到的权限，NapCat 以其他用户运行时也能读取
+_UMASK = os.umask(0); os.umask(_UMASK)
+SUBMISSION_FILE_MODE = 0o666 & ~_UMASK
+
+async def download_image(url: str, dest_dir: Path) -> Optional[Path]:
+    """分块流式写入 dest_dir 下的临时文件并返回其路径，调用方负责原子改名或删除；超过大小上限时抛出 ImageTooLargeError"""
+    limit = IMAGE_SIZE_LIMIT_MB * 1024 * 1024
+    url = url.replace("&amp;", "&")
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(dir=dest_dir, prefix=".submission_", suffix=".part")
+    temp_path = Path(temp_name)
     try:
-        url = url.replace("&amp;", "&")
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, timeout=60, follow_redirects=True)
-            response.raise_for_status()
-            return response.content
+        with os.fdopen(fd, 'wb') as f:
+            async with get_download_client().stream("GET", url) as response:
+                response.raise_for_status()
+                content_length = response.headers.get("Content-Length", "")
+                if content_length.isdigit() and int(content_length) > limit:
+                    raise ImageTooLargeError(f"Content-Length {content_length} 超过上限")
+                received = 0
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > limit: raise ImageTooLargeError(f"已接收 {received} 字节，超过上限")
+                    f.write(chunk)
+        os.chmod(temp_path, SUBMISSION_FILE_MODE)
+        return temp_path
+    except ImageTooLargeError as e:
+        logger.warning(f"投稿图片过大，已中止下载: {url} ({e})")
+        temp_path.unlink(missing_ok=True)
+        raise
     except Exception:
         logger.exception(f"下载图片失败: {url}")
+        temp_path.unlink(missing_ok=True)
         return None
 
-# --- 4. 业务逻辑处理模块 ---
+# --- 7. 业务逻辑处理模块 ---
 def extract_image_url_from_cq_code(message_str: str) -> Optional[str]:
     if not isinstance(message_str, str): return None
     match = re.search(r"\[CQ:image,.*?url=([^,\]]+)", message_str)
     if match: return match.group(1)
     return None
 
-async def silent_timeout_killer(user_id: int, timeout: int):
+def end_session(user_id: int, session: SubmissionSession):
+    """结束会话：取消超时任务，且只在字典里仍是这个会话时才移除，避免误删用户随后开启的新会话"""
+    if session.timeout_task and session.timeout_task is not asyncio.current_task():
+        session.timeout_task.cancel()
+    if USER_SESSIONS.get(user_id) is session:
+        del USER_SESSIONS[user_id]
+
+async def silent_timeout_killer(user_id: int, session: SubmissionSession, timeout: int):
     await asyncio.sleep(timeout)
-    async with _session_lock:
-        if user_id in USER_SESSIONS:
+    async with session.lock:
+        if USER_SESSIONS.get(user_id) is session:
             logger.info(f"用户 {user_id} 的投稿因超时 ({timeout}s) 被静默取消。")
-            del USER_SESSIONS[user_id]
+            end_session(user_id, session)
 
 async def start_submission(user_id: int, group_id: int):
-    async with _session_lock:
-        if user_id in USER_SESSIONS:
-            await send_group_msg(group_id, [{"type": "text", "data": {"text": "您当前已经在一个投稿流程中，请先完成或使用“取消投稿”来退出。"}}])
-            return
-        asyncio.create_task(silent_timeout_killer(user_id, SUBMISSION_AWAIT_IMAGE_TIMEOUT))
-        USER_SESSIONS[user_id] = SubmissionSession(group_id=group_id)
+    if user_id in USER_SESSIONS:
+        await send_group_msg(group_id, [{"type": "text", "data": {"text": "您当前已经在一个投稿流程中，请先完成或使用“取消投稿”来退出。"}}])
+        return
+    session = USER_SESSIONS[user_id] = SubmissionSession(group_id=group_id)
+    session.timeout_task = asyncio.create_task(silent_timeout_killer(user_id, session, SUBMISSION_AWAIT_IMAGE_TIMEOUT))
     logger.info(f"用户 {user_id} 在群 {group_id} 开始投稿流程，设置 {SUBMISSION_AWAIT_IMAGE_TIMEOUT} 秒超时。")
     await send_group_msg(group_id, [{"type": "text", "data": {"text": f"请在 {SUBMISSION_AWAIT_IMAGE_TIMEOUT} 秒内发送您要投稿的图片（AI生成图片将被拒绝）。\n随时可以发送“取消投稿”来退出流程。"}}])
 
 async def cancel_submission(user_id: int, group_id: int):
-    async with _session_lock:
-        if user_id in USER_SESSIONS:
-            session = USER_SESSIONS.pop(user_id)
-            if session.timeout_task: session.timeout_task.cancel()
-            logger.info(f"用户 {user_id} 已取消投稿。")
-            await send_group_msg(group_id, [{"type": "text", "data": {"text": "投稿流程已取消。"}}])
+    session = USER_SESSIONS.get(user_id)
+    if session:
+        end_session(user_id, session)
+        logger.info(f"用户 {user_id} 已取消投稿。")
+        await send_group_msg(group_id, [{"type": "text", "data": {"text": "投稿流程已取消。"}}])
 
 async def process_submission_step(user_id: int, data: dict):
-    async with _session_lock:
-        session = USER_SESSIONS.get(user_id)
-        if not session: return
+    session = USER_SESSIONS.get(user_id)
+    if not session: return
+    async with session.lock:
+        # 等锁期间会话可能已被取消或超时
+        if USER_SESSIONS.get(user_id) is not session: return
 
         group_id = session.group_id
         raw_message = data.get("raw_message", "").strip()
@@ -115,7 +635,7 @@ async def process_submission_step(user_id: int, data: dict):
         
         if session.timeout_task:
             session.timeout_task.cancel()
-        session.timeout_task = asyncio.create_task(silent_timeout_killer(user_id, SUBMISSION_STEP_TIMEOUT))
+        session.timeout_task = asyncio.create_task(silent_timeout_killer(user_id, session, SUBMISSION_STEP_TIMEOUT))
         
         if session.state == 'awaiting_image':
             image_url = None
@@ -131,8 +651,7 @@ async def process_submission_step(user_id: int, data: dict):
             # --- 修复结束 ---
 
             if not image_url:
-                if session.timeout_task: session.timeout_task.cancel()
-                del USER_SESSIONS[user_id]
+                end_session(user_id, session)
                 await send_group_msg(group_id, [{"type": "text", "data": {"text": "您发送的不是图片，投稿流程已自动取消。" }}])
                 return
             
@@ -149,8 +668,7 @@ async def process_submission_step(user_id: int, data: dict):
             invalid_chars = r'[\\/:*?"<>|]'
             is_invalid = re.search(invalid_chars, raw_message) or raw_message.startswith('[CQ:')
             if not raw_message or len(raw_message) > 50 or is_invalid:
-                if session.timeout_task: session.timeout_task.cancel()
-                del USER_SESSIONS[user_id]
+                end_session(user_id, session)
                 await send_group_msg(group_id, [{"type": "text", "data": {"text": "画师名称无效，投稿流程已自动取消。"}}])
                 return
             session.artist_name = raw_message
@@ -161,8 +679,7 @@ async def process_submission_step(user_id: int, data: dict):
             
         elif session.state == 'awaiting_source':
             if raw_message not in SOURCE_MAP:
-                if session.timeout_task: session.timeout_task.cancel()
-                del USER_SESSIONS[user_id]
+                end_session(user_id, session)
                 await send_group_msg(group_id, [{"type": "text", "data": {"text": "来源编号无效，投稿流程已自动取消。"}}])
                 return
             session.source_prefix = SOURCE_MAP[raw_message]
@@ -184,28 +701,73 @@ async def process_submission_step(user_id: int, data: dict):
                 if raw_message.isdigit():
                     is_valid_id = True
             if not is_valid_id:
-                if session.timeout_task: session.timeout_task.cancel()
-                del USER_SESSIONS[user_id]
+                end_session(user_id, session)
                 await send_group_msg(group_id, [{"type": "text", "data": {"text": "ID格式无效，投稿流程已自动取消。"}}])
                 return
 
             session.artwork_id = raw_message
             logger.info(f"User {user_id} submitted ID: {raw_message}, process finished, preparing to save.")
-            if session.timeout_task: session.timeout_task.cancel()
-            image_data = await download_image(session.image_url)
-            if not image_data:
-                await send_group_msg(group_id, [{"type": "text", "data": {"text": "抱歉，下载图片失败，投稿中断。请稍后再试。"}}])
-            else:
-                base_path = Path(__file__).parent / IMAGE_ROOT_DIR_NAME
-                artist_path = base_path / session.artist_name
-                artist_path.mkdir(parents=True, exist_ok=True)
-                file_name = f"{session.source_prefix}_{session.artwork_id}{session.image_ext}"
-                final_path = artist_path / file_name
-                with open(final_path, 'wb') as f: f.write(image_data)
-                logger.info(f"File successfully saved to: {final_path}")
-                await send_group_msg(group_id, [{"type": "text", "data": {"text": "投稿成功！感谢您为鹿图库做的贡献！"}}])
-            if user_id in USER_SESSIONS:
-                del USER_SESSIONS[user_id]
+            end_session(user_id, session)
+
+    # 会话已结束，下载和保存在任何锁之外进行，慢下载不会拖住其他投稿者
+    if session.artwork_id:
+        await save_submission(session)
+
+def clean_submission_leftovers():
+    """删除上次异常退出时残留的下载临时文件（含旧版本留在画师目录里的）"""
+    leftovers = [*SUBMISSION_TEMP_DIR.glob(".submission_*.part"), *BLOBS.temp_dir.glob(".submission_*.part")]
+    gallery_root = Path(__file__).parent / IMAGE_ROOT_DIR_NAME
+    if gallery_root.is_dir(): leftovers += gallery_root.glob("*/.submission_*.part")
+    for path in leftovers: path.unlink(missing_ok=True)
+    if leftovers: logger.info(f"已清理 {len(leftovers)} 个残留的投稿临时文件。")
+
+async def save_submission(session: SubmissionSession):
+    group_id = session.group_id
+    use_blobs = STORAGE_MODE == "blobs"
+    artist_path = GALLERY.base_path / session.artist_name
+    try:
+        # 先下载到图库外的临时目录，通过大小和去重检查后才创建画师目录，失败的投稿不会留下空文件夹
+        temp_path = await download_image(session.image_url, BLOBS.temp_dir if use_blobs else SUBMISSION_TEMP_DIR)
+        failure_text = "抱歉，下载图片失败，投稿中断。请稍后再试。"
+    except ImageTooLargeError:
+        temp_path, failure_text = None, f"图片超过 {IMAGE_SIZE_LIMIT_MB}MB 上限，投稿中断。"
+    if not temp_path:
+        await send_group_msg(group_id, [{"type": "text", "data": {"text": failure_text}}])
+        return
+    image_hash = None
+    if Image is not None:
+        try:
+            image_hash = await asyncio.get_running_loop().run_in_executor(get_process_pool(), compute_dhash, str(temp_path))
+        except Exception:
+            logger.exception(f"计算投稿图片哈希失败，跳过去重检查: {temp_path}")
+    if image_hash is not None and (duplicate := DEDUPE.find_similar(image_hash)):
+        temp_path.unlink(missing_ok=True)
+        existing = GALLERY.find(duplicate[0])
+        described = f"画师：{existing.artist}，来源：{existing.source_text} ID：{existing.id_text}" if existing else duplicate[0]
+        logger.info(f"投稿图片与已有图片 {duplicate[0]} 重复（距离 {duplicate[1]}），已拒绝。")
+        await send_group_msg(group_id, [{"type": "text", "data": {"text": f"这张图片疑似已在图库中（{described}），投稿未保存。"}}])
+        return
+    if use_blobs:
+        digest, final_path = await asyncio.to_thread(BLOBS.put, temp_path, session.image_ext, True)
+        await asyncio.to_thread(BLOBS.register, [(session.artist_name, session.source_prefix, session.artwork_id, digest, session.image_ext.lower())])
+        image = GalleryImage(final_path, session.artist_name, *describe_image_file(Path(f"{session.source_prefix}_{session.artwork_id}{session.image_ext}")), digest)
+    else:
+        file_name = f"{session.source_prefix}_{session.artwork_id}{session.image_ext}"
+        final_path = artist_path / file_name
+        try:
+            artist_path.mkdir(parents=True, exist_ok=True)
+            os.replace(temp_path, final_path)
+        except OSError:
+            temp_path.unlink(missing_ok=True)
+            raise
+        image = GalleryImage.from_path(final_path, session.artist_name)
+    logger.info(f"File successfully saved to: {final_path}")
+    GALLERY.add(image)
+    VARIANTS.schedule(image)
+    if image_hash is not None:
+        DEDUPE.add(image.key, final_path.stat().st_mtime, image_hash)
+        await DEDUPE.try_save()
+    await send_group_msg(group_id, [{"type": "text", "data": {"text": "投稿成功！感谢您为鹿图库做的贡献！"}}])
 
 async def handle_message(data: dict):
     post_type = data.get("post_type")
@@ -216,10 +778,7 @@ async def handle_message(data: dict):
     group_id = data.get("group_id")
     user_id = data.get("user_id")
 
-    async with _session_lock:
-        is_in_session = user_id in USER_SESSIONS
-
-    if is_in_session:
+    if user_id in USER_SESSIONS:
         if raw_message in ["取消投稿", "取消"]:
             await cancel_submission(user_id, group_id)
         else:
@@ -230,85 +789,97 @@ async def handle_message(data: dict):
         await start_submission(user_id, group_id)
     elif raw_message == "鹿图推荐":
         logger.info(f"Matched command '鹿图推荐' in group {group_id}")
-        base_image_path = Path(__file__).parent / IMAGE_ROOT_DIR_NAME
-        if not base_image_path.is_dir():
-            await send_group_msg(group_id, [{"type": "text", "data": {"text": f"错误：找不到图片目录 '{IMAGE_ROOT_DIR_NAME}'。"}}])
+        if not GALLERY.is_available():
+            await send_group_msg(group_id, [{"type": "text", "data": {"text": f"错误：找不到图片目录 '{GALLERY.base_path.name}'。"}}])
             return
-        artist_dirs = [d for d in base_image_path.iterdir() if d.is_dir()]
-        if not artist_dirs:
+        image = GALLERY.choose()
+        if not image:
             await send_group_msg(group_id, [{"type": "text", "data": {"text": f"错误：'{IMAGE_ROOT_DIR_NAME}' 内没有画师文件夹。"}}])
             return
-        random_artist_path = random.choice(artist_dirs)
-        image_files = [f for f in random_artist_path.iterdir() if f.is_file() and f.name.lower().endswith(('png', 'jpg', 'jpeg', 'gif', 'bmp'))]
-        if not image_files:
-            await send_group_msg(group_id, [{"type": "text", "data": {"text": f"画师 '{random_artist_path.name}' 的文件夹是空的。"}}])
+        LAST_RECOMMENDED[group_id] = image
+        send_path = VARIANTS.lookup(image) or image.path
+        text_content = f"为您推荐的图片是：\n画师：{image.artist}\n来源：{image.source_text} ID：{image.id_text}\n"
+        if send_path != image.path:
+            text_content += "（已压缩，发送“鹿图原图”可查看原图）\n"
+        await send_image_message(group_id, user_id, text_content, send_path)
+    elif raw_message == "鹿图原图":
+        image = LAST_RECOMMENDED.get(group_id)
+        if not image or not image.path.is_file():
+            await send_group_msg(group_id, [{"type": "text", "data": {"text": "本群还没有推荐过图片，请先发送“鹿图推荐”。"}}])
             return
-        random_image_path = random.choice(image_files)
-        source_text, id_text = "未知来源", "未知"
-        file_name_upper = random_image_path.name.upper()
-        if file_name_upper.startswith("B_"):
-            source_text = "b站动态"
-            match = re.search(r"B_(\d+)", file_name_upper)
-            if match: id_text = match.group(1)
-        elif file_name_upper.startswith("P_"):
-            source_text = "Pixiv"
-            match = re.search(r"P_(\d+)", file_name_upper)
-            if match: id_text = match.group(1)
-        elif file_name_upper.startswith("X_"):
-            source_text = "X动态"
-            match = re.search(r"X_(\d+)", file_name_upper)
-            if match: id_text = match.group(1)
-        elif file_name_upper.startswith("BV_"):
-            source_text = "b站视频"
-            id_text = random_image_path.stem.split('_', 1)[1]
-        
-        text_content = f"为您推荐的图片是：\n画师：{random_artist_path.name}\n来源：{source_text} ID：{id_text}\n"
-        image_uri = random_image_path.as_uri()
-        response_message = [
-            {"type": "at", "data": {"qq": str(user_id)}},
-            {"type": "text", "data": {"text": f"\n{text_content}"}},
-            {"type": "image", "data": {"file": image_uri}}
-        ]
-        async def sender_coro():
-            await send_group_msg(group_id, response_message)
-        async def reminder_coro():
-            await asyncio.sleep(SEND_TIMEOUT_SECONDS)
-            await send_group_msg(group_id, [{"type": "text", "data": {"text": "图片可能过大，请稍后"}}])
-            logger.info(f"发送超时提醒到群聊 {group_id}。")
-        sender_task = asyncio.create_task(sender_coro())
-        reminder_task = asyncio.create_task(reminder_coro())
-        done, pending = await asyncio.wait({sender_task, reminder_task}, return_when=asyncio.FIRST_COMPLETED)
-        if sender_task in done:
-            reminder_task.cancel()
-        else:
-            logger.info(f"发送超过 {SEND_TIMEOUT_SECONDS} 秒，已发送提醒，图片仍在后台发送中。")
+        text_content = f"原图：\n画师：{image.artist}\n来源：{image.source_text} ID：{image.id_text}\n"
+        await send_image_message(group_id, user_id, text_content, image.path)
 
-# --- 5. 主程序循环 ---
+async def send_image_message(group_id: int, user_id: int, text_content: str, image_path: Path):
+    """发送图片消息，超过 SEND_TIMEOUT_SECONDS 仍未完成时先发一条提醒，图片继续在后台发送"""
+    response_message = [
+        {"type": "at", "data": {"qq": str(user_id)}},
+        {"type": "text", "data": {"text": f"\n{text_content}"}},
+        {"type": "image", "data": {"file": image_path.as_uri()}}
+    ]
+    async def sender_coro():
+        await send_group_msg(group_id, response_message)
+    async def reminder_coro():
+        await asyncio.sleep(SEND_TIMEOUT_SECONDS)
+        await send_group_msg(group_id, [{"type": "text", "data": {"text": "图片可能过大，请稍后"}}])
+        logger.info(f"发送超时提醒到群聊 {group_id}。")
+    sender_task = asyncio.create_task(sender_coro())
+    reminder_task = asyncio.create_task(reminder_coro())
+    done, pending = await asyncio.wait({sender_task, reminder_task}, return_when=asyncio.FIRST_COMPLETED)
+    if sender_task in done:
+        reminder_task.cancel()
+    else:
+        logger.info(f"发送超过 {SEND_TIMEOUT_SECONDS} 秒，已发送提醒，图片仍在后台发送中。")
+
+# --- 8. 主程序循环 ---
 async def main():
     logger.info("纯粹模式机器人已启动...")
     logger.info(f"将从 WebSocket ({WEBSOCKET_URI}) 接收事件。")
     logger.info(f"将通过 HTTP API ({ONEBOT_HTTP_API_URL}) 发送消息。")
-    while True:
-        try:
-            logger.info("正在连接到 WebSocket...")
-            async with websockets.connect(WEBSOCKET_URI) as websocket:
-                logger.info("WebSocket 连接成功！开始监听...")
-                async for message in websocket:
-                    try:
-                        data = json.loads(message)
-                        asyncio.create_task(handle_message(data))
-                    except json.JSONDecodeError:
-                        logger.warning(f"收到非 JSON 格式的消息: {message}")
-                    except Exception:
-                        logger.exception("处理单个事件时发生未知错误。")
-        except (websockets.exceptions.ConnectionClosedError, ConnectionRefusedError) as e:
-            logger.error(f"WebSocket 连接失败或中断: {e}. 将在10秒后重试...")
-            await asyncio.sleep(10)
-        except Exception:
-            logger.exception("主循环发生未知严重错误，将在10秒后重试...")
-            await asyncio.sleep(10)
+    await asyncio.to_thread(clean_submission_leftovers)
+    await asyncio.to_thread(GALLERY.refresh)
+    logger.info(f"鹿图索引建立完成：{len(GALLERY.artist_names)} 位画师，{len(GALLERY.all_images)} 张图片。")
+    asyncio.create_task(refresh_gallery_periodically())
+    await asyncio.to_thread(VARIANTS.load)
+    if Image is None:
+        logger.warning("未安装 Pillow，投稿去重检查和压缩图缓存已关闭（pip install Pillow）。")
+    else:
+        asyncio.create_task(DEDUPE.backfill(GALLERY))
+    try:
+        while True:
+            try:
+                logger.info("正在连接到 WebSocket...")
+                async with websockets.connect(WEBSOCKET_URI) as websocket:
+                    logger.info("WebSocket 连接成功！开始监听...")
+                    async for message in websocket:
+                        try:
+                            data = json.loads(message)
+                            asyncio.create_task(handle_message(data))
+                        except json.JSONDecodeError:
+                            logger.warning(f"收到非 JSON 格式的消息: {message}")
+                        except Exception:
+                            logger.exception("处理单个事件时发生未知错误。")
+            except (websockets.exceptions.ConnectionClosedError, ConnectionRefusedError) as e:
+                logger.error(f"WebSocket 连接失败或中断: {e}. 将在10秒后重试...")
+                await asyncio.sleep(10)
+            except Exception:
+                logger.exception("主循环发生未知严重错误，将在10秒后重试...")
+                await asyncio.sleep(10)
+    finally:
+        await close_http_clients()
+        if _process_pool: _process_pool.shutdown(cancel_futures=True)
+
+def import_legacy_library():
+    base_path = Path(__file__).parent / IMAGE_ROOT_DIR_NAME
+    if not base_path.is_dir():
+        logger.error(f"找不到旧图片目录 '{IMAGE_ROOT_DIR_NAME}'，无需导入。"); return
+    started = time.monotonic()
+    count = BLOBS.import_legacy(base_path)
+    logger.info(f"已将 {count} 张图片导入 '{BLOB_STORE_DIR_NAME}'，耗时 {time.monotonic() - started:.1f} 秒。将 STORAGE_MODE 改为 \"blobs\" 即可启用。")
 
 if __name__ == "__main__":
+    if "--import-legacy" in sys.argv:
+        import_legacy_library(); sys.exit()
     try:
         asyncio.run(main())
     except KeyboardInterrupt: